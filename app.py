@@ -1,60 +1,151 @@
 import dash
-from dash import dcc, html, Input, Output, State, callback_context, ALL, MATCH
+import flask
+from dash import dcc, html, Input, Output, State, callback_context, ALL, MATCH, Patch
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
-from sqlalchemy.orm import Session
-from db import engine, init_db, User, Repository, PullRequest, Comment, create_user
-from git_utils import list_repositories, get_repo_branches, create_branch, get_diff, merge_branch
-import pandas as pd
-import bcrypt
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.exc import IntegrityError
+from db import engine, init_db, User, Repository, PullRequest, Comment, create_user, get_pr_page, count_prs, sync_repositories, get_repository_options, get_user_info, invalidate_user, get_bootstrap_key, get_comment_page, record_event, get_latest_event_id, get_events, save_pr_stats, save_pr_mergeability, search_prs, SNIPPET_START, SNIPPET_END
+from git_utils import scan_repositories, search_branches, create_branch, iter_diff_summary, get_file_patch, merge_branch, get_branch_heads, get_diff_stats, check_mergeability, get_commit_page, get_repo_pool_stats, get_diff_cache_stats
+from sessions import session_store
+from passwords import hash_password, hash_password_inline, verify_password, needs_rehash, PasswordQueueFull
 import os
+import json
+from contextlib import contextmanager
+from datetime import datetime
+import config
+from merge_queue import merge_queue
+from metrics import metrics, instrument
+from scheduler import scheduler
+from mirrors import mirrors
 
-# Initialize DB
-init_db()
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-# Create default admin if not exists
-with Session(engine) as session:
-    if not session.query(User).filter_by(username='admin').first():
-        hashed = bcrypt.hashpw('admin'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        admin = User(username='admin', password_hash=hashed, is_admin=True)
-        session.add(admin)
-        session.commit()
+@contextmanager
+def bootstrap_lock():
+    """Makes processes starting at the same time bootstrap one at a time."""
+    with open(config.BOOTSTRAP_LOCK_PATH, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield  # closing the file releases the lock
+
+def bootstrap_done():
+    key = get_bootstrap_key()
+    try:
+        with open(config.BOOTSTRAP_MARKER_PATH) as f:
+            return key is not None and json.load(f) == key
+    except (OSError, ValueError):
+        return False
+
+def bootstrap():
+    """Startup work: applies migrations and creates the default admin.
+
+    Done once per deployment rather than per process: the marker file
+    records the database and schema version it ran for, and later starts
+    against the same ones skip it. Safe to run from several processes at
+    once.
+    """
+    if not bootstrap_done():
+        with bootstrap_lock():
+            # Another process may have finished while we waited
+            if not bootstrap_done():
+                init_db()
+
+                # Create default admin if not exists
+                with Session(engine) as session:
+                    if not session.query(User).filter_by(username='admin').first():
+                        hashed = hash_password_inline('admin')
+                        admin = User(username='admin', password_hash=hashed, is_admin=True)
+                        session.add(admin)
+                        try:
+                            session.commit()
+                        except IntegrityError:
+                            # Another host created it first
+                            session.rollback()
+
+                with open(config.BOOTSTRAP_MARKER_PATH, 'w') as f:
+                    json.dump(get_bootstrap_key(), f)
+
+    # Forked workers inherit the mirror locations
+    with Session(engine) as session:
+        for path, remote_path in session.query(Repository.path, Repository.remote_path):
+            mirrors.register(path, remote_path)
+
+    # Don't hand connections opened here down to forked workers
+    engine.dispose()
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
 app.title = "GitWatch"
 
+# PreventUpdate is how callbacks skip an update, not a failure
+instrument_callback = instrument('callback', ignore=(PreventUpdate,))
+
+# Metrics are exported by this process only; each gunicorn worker has its own
+metrics.register_gauges('gitwatch_repo_pool', get_repo_pool_stats)
+metrics.register_gauges('gitwatch_diff_cache', get_diff_cache_stats)
+metrics.register_gauges('gitwatch_merge_queue', merge_queue.stats)
+metrics.register_gauges('gitwatch_scheduler', scheduler.stats)
+metrics.register_gauges('gitwatch_mirrors', mirrors.stats)
+_callback_names = {}
+
+
+@app.server.route('/metrics')
+def metrics_endpoint():
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.server.after_request
+def record_callback_payload(response):
+    if flask.request.path.endswith('/_dash-update-component') and response.status_code == 200:
+        body = flask.request.get_json(silent=True) or {}
+        output = body.get('output', '')
+        name = _callback_names.get(output)
+        if name is None:
+            callback = app.callback_map.get(output, {}).get('callback')
+            name = _callback_names[output] = getattr(callback, '__name__', 'unknown')
+        metrics.observe_payload(name, 'request', flask.request.content_length or 0)
+        metrics.observe_payload(name, 'response', response.calculate_content_length() or 0)
+    return response
+
+
 # Layouts
-login_layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.H2("GitWatch Login", className="text-center mb-4"),
-            dbc.Input(id="login-username", placeholder="Username", type="text", className="mb-2"),
-            dbc.Input(id="login-password", placeholder="Password", type="password", className="mb-2"),
-            dbc.Button("Login", id="login-button", color="primary", className="w-100"),
-            html.Div(id="login-alert", className="mt-2"),
-            html.Div([
-                "Don't have an account? ",
-                dcc.Link("Sign up here", href="/signup")
-            ], className="mt-3 text-center")
-        ], width=4, className="mx-auto mt-5")
+def get_login_layout():
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.H2("GitWatch Login", className="text-center mb-4"),
+                dbc.Input(id="login-username", placeholder="Username", type="text", className="mb-2"),
+                dbc.Input(id="login-password", placeholder="Password", type="password", className="mb-2"),
+                dbc.Button("Login", id="login-button", color="primary", className="w-100"),
+                html.Div(id="login-alert", className="mt-2"),
+                html.Div([
+                    "Don't have an account? ",
+                    dcc.Link("Sign up here", href="/signup")
+                ], className="mt-3 text-center")
+            ], width=4, className="mx-auto mt-5")
+        ])
     ])
-])
 
-signup_layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.H2("GitWatch Sign Up", className="text-center mb-4"),
-            dbc.Input(id="signup-username", placeholder="Username", type="text", className="mb-2"),
-            dbc.Input(id="signup-password", placeholder="Password", type="password", className="mb-2"),
-            dbc.Input(id="signup-confirm", placeholder="Confirm Password", type="password", className="mb-2"),
-            dbc.Button("Sign Up", id="signup-button", color="success", className="w-100"),
-            html.Div(id="signup-alert", className="mt-2"),
-            html.Div([
-                "Already have an account? ",
-                dcc.Link("Login here", href="/login")
-            ], className="mt-3 text-center")
-        ], width=4, className="mx-auto mt-5")
+def get_signup_layout():
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.H2("GitWatch Sign Up", className="text-center mb-4"),
+                dbc.Input(id="signup-username", placeholder="Username", type="text", className="mb-2"),
+                dbc.Input(id="signup-password", placeholder="Password", type="password", className="mb-2"),
+                dbc.Input(id="signup-confirm", placeholder="Confirm Password", type="password", className="mb-2"),
+                dbc.Button("Sign Up", id="signup-button", color="success", className="w-100"),
+                html.Div(id="signup-alert", className="mt-2"),
+                html.Div([
+                    "Already have an account? ",
+                    dcc.Link("Login here", href="/login")
+                ], className="mt-3 text-center")
+            ], width=4, className="mx-auto mt-5")
+        ])
     ])
-])
 
 def get_sidebar(user_data):
     return html.Div([
@@ -63,79 +154,189 @@ def get_sidebar(user_data):
         dbc.Nav([
             dbc.NavLink("Dashboard", href="/", active="exact"),
             dbc.NavLink("New Pull Request", href="/new-pr", active="exact"),
+            dbc.NavLink("Search", href="/search", active="exact"),
             dbc.NavLink("Logout", id="logout-btn", href="#", active="exact"),
         ], vertical=True, pills=True),
     ], style={"padding": "2rem 1rem", "backgroundColor": "#f8f9fa", "height": "100vh"})
 
+def get_pr_stats_line(stats):
+    if stats is None:
+        return None
+    return html.Small([
+        f"{stats.files_changed} file{'s' if stats.files_changed != 1 else ''} changed ",
+        html.Span(f"+{stats.additions}", className="text-success"),
+        " ",
+        html.Span(f"-{stats.deletions}", className="text-danger"),
+    ], className="text-muted")
+
+def get_mergeability_badge(pr, stale=False):
+    """Badge from the last background merge check. Shows "Checking…" until
+    the first check, or while a check of the current heads is pending."""
+    result = pr.mergeability
+    if pr.status != 'open':
+        return None
+    if result is None or stale:
+        return dbc.Badge("Checking…", color="light", text_color="secondary", className="ms-2")
+    if result.state == 'unknown':
+        return None
+    label, color = {
+        'clean': ("Mergeable", "success"),
+        'conflicts': ("Conflicts", "danger"),
+        'merged': ("Already merged", "secondary"),
+    }[result.state]
+    return dbc.Badge(label, color=color, className="ms-2")
+
+def get_pr_list_item(pr, live=False):
+    # Live items carry an id so the change feed can hide them once closed
+    extra = {'id': {"type": "open-pr", "index": pr.id}} if live else {}
+    return dbc.ListGroupItem([
+        html.Div([
+            html.H5([pr.title, get_mergeability_badge(pr)], className="mb-1"),
+            html.Small(f"#{pr.id} opened by {pr.author.username} • {pr.status}")
+        ], className="d-flex w-100 justify-content-between"),
+        html.P(f"Repo: {pr.repo.name} | {pr.source_branch} -> {pr.target_branch}", className="mb-1"),
+        get_pr_stats_line(pr.stats)
+    ], href=f"/pr/{pr.id}", action=True, **extra)
+
+def refresh_pr_stats(session, pr, heads):
+    """Recomputes the stored diff stats of pr if either branch head moved
+    since they were computed. heads is (source_sha, target_sha) from
+    get_branch_heads. Returns True if the row was written; the caller
+    commits. Run it outside write transactions: it calls git."""
+    if pr.stats is not None and (pr.stats.source_sha, pr.stats.target_sha) == heads:
+        return False
+    stats = get_diff_stats(pr.repo.path, pr.source_branch, pr.target_branch)
+    if stats is None:
+        return False
+    save_pr_stats(session, pr.id, stats)
+    return True
+
+def refresh_pr_mergeability(session, pr, heads):
+    """Same as refresh_pr_stats, for the stored merge check."""
+    if pr.mergeability is not None and (pr.mergeability.source_sha, pr.mergeability.target_sha) == heads:
+        return False
+    result = check_mergeability(pr.repo.path, pr.source_branch, pr.target_branch)
+    if result is None:
+        return False
+    save_pr_mergeability(session, pr.id, result)
+    return True
+
+def refresh_open_prs():
+    """Background job: brings the stats and merge check of every open PR up
+    to date. PRs whose branch heads did not move cost one rev-parse. Merge
+    checks are only computed here; pages show the stored results."""
+    with Session(engine, expire_on_commit=False) as session:
+        prs = (
+            session.query(PullRequest)
+            .options(joinedload(PullRequest.repo), joinedload(PullRequest.stats),
+                     joinedload(PullRequest.mergeability))
+            .filter(PullRequest.status == 'open')
+            .all()
+        )
+        # Release the read transaction while git runs
+        session.commit()
+        for pr in prs:
+            heads = get_branch_heads(pr.repo.path, pr.source_branch, pr.target_branch)
+            if heads is None:
+                continue
+            changed = refresh_pr_stats(session, pr, heads)
+            changed = refresh_pr_mergeability(session, pr, heads) or changed
+            if changed:
+                session.commit()
+
+def fetch_mirrors():
+    """Background job: creates and fetches the bare mirrors that git reads
+    are served from. Mirrors.fetch_due decides which repos are due."""
+    with Session(engine, expire_on_commit=False) as session:
+        repos = session.query(Repository).all()
+        for repo in repos:
+            if repo.remote_path is None:
+                repo.remote_path = mirrors.default_path(repo.path)
+        session.commit()
+        paths = [(repo.path, repo.remote_path) for repo in repos]
+    mirrors.fetch_due(paths)
+
+scheduler.add('mergeability', config.MERGEABILITY_INTERVAL, refresh_open_prs)
+if config.MIRRORS_ENABLED:
+    scheduler.add('mirrors', mirrors.TICK_SECONDS, fetch_mirrors, jitter=0)
+
+def load_pr_page(status, cursor=None):
+    """Returns (list items, next cursor) for one dashboard page."""
+    with Session(engine) as session:
+        prs, next_cursor = get_pr_page(session, status, cursor, limit=config.DASHBOARD_PAGE_SIZE)
+        return [get_pr_list_item(pr, live=(status == 'open')) for pr in prs], next_cursor
+
+def get_load_more_style(cursor):
+    return {} if cursor else {"display": "none"}
+
+def get_live_poll(prefix, version):
+    """Interval plus stores for a page that follows the change feed:
+    <prefix>-version is the last event applied to the page and
+    <prefix>-latest the newest event seen by the poll."""
+    return html.Div([
+        dcc.Interval(id=f"{prefix}-poll", interval=config.LIVE_UPDATE_INTERVAL_MS or 60000,
+                     disabled=not config.LIVE_UPDATE_INTERVAL_MS),
+        dcc.Store(id=f"{prefix}-version", data=version),
+        dcc.Store(id=f"{prefix}-latest", data=version),
+    ])
+
 def get_dashboard_layout(user_data):
+    # Read the feed version first so changes made while rendering are replayed
     with Session(engine) as session:
-        all_prs = session.query(PullRequest).all()
-        open_prs = [pr for pr in all_prs if pr.status == 'open']
-        closed_prs = [pr for pr in all_prs if pr.status == 'closed']
-        
-        # Build open requests list
-        pr_list = []
-        if not open_prs:
-            pr_list.append(dbc.ListGroupItem("No active pull requests found."))
-        else:
-            for pr in open_prs:
-                pr_list.append(
-                    dbc.ListGroupItem([
-                        html.Div([
-                            html.H5(pr.title, className="mb-1"),
-                            html.Small(f"#{pr.id} opened by {pr.author.username} • {pr.status}")
-                        ], className="d-flex w-100 justify-content-between"),
-                        html.P(f"Repo: {pr.repo.name} | {pr.source_branch} -> {pr.target_branch}", className="mb-1")
-                    ], href=f"/pr/{pr.id}", action=True)
-                )
-        
-        # Build closed requests list
-        closed_list = []
-        if closed_prs:
-            for pr in closed_prs:
-                closed_list.append(
-                    dbc.ListGroupItem([
-                        html.Div([
-                            html.H5(pr.title, className="mb-1"),
-                            html.Small(f"#{pr.id} opened by {pr.author.username} • {pr.status}")
-                        ], className="d-flex w-100 justify-content-between"),
-                        html.P(f"Repo: {pr.repo.name} | {pr.source_branch} -> {pr.target_branch}", className="mb-1")
-                    ], href=f"/pr/{pr.id}", action=True)
-                )
-        
-        # Build closed section (collapsed dropdown)
-        closed_section = html.Div()
-        if closed_prs:
-            closed_section = html.Div([
-                dbc.Button(
-                    ["Closed (", len(closed_prs), ")"],
-                    id="closed-toggle",
-                    color="secondary",
-                    className="mt-4 w-100 text-start",
-                    style={"textDecoration": "none"}
-                ),
-                dbc.Collapse(
-                    dbc.ListGroup(closed_list, className="mt-2"),
-                    id="closed-collapse",
-                    is_open=False,
-                    className="mb-4"
-                )
-            ])
+        version = get_latest_event_id(session)
+
+    # Build open requests list (first page only, more on demand)
+    pr_list, open_cursor = load_pr_page('open')
+
+    with Session(engine) as session:
+        closed_count = count_prs(session, 'closed')
+
+    # Build closed section (collapsed dropdown, loaded when first opened)
+    closed_section = html.Div()
+    if closed_count:
+        closed_section = html.Div([
+            dbc.Button(
+                ["Closed (", closed_count, ")"],
+                id="closed-toggle",
+                color="secondary",
+                className="mt-4 w-100 text-start",
+                style={"textDecoration": "none"}
+            ),
+            dbc.Collapse([
+                dbc.ListGroup([], id="closed-list", className="mt-2"),
+                dbc.Button("Load more", id="closed-load-more", color="link", style={"display": "none"}),
+                dcc.Store(id="closed-cursor", data={'loaded': False, 'cursor': None})
+            ], id="closed-collapse", is_open=False, className="mb-4")
+        ])
 
     return dbc.Container([
         dbc.Row([
             dbc.Col(get_sidebar(user_data), width=2),
             dbc.Col([
                 html.H2("Dashboard", className="mt-4"),
-                dbc.ListGroup(pr_list, className="mt-4"),
+                html.P("No active pull requests found.", id="open-empty", className="mt-4",
+                       style={"display": "none"} if pr_list else {}),
+                dbc.ListGroup(pr_list, id="open-list", className="mt-4"),
+                dbc.Button("Load more", id="open-load-more", color="link", style=get_load_more_style(open_cursor)),
+                dcc.Store(id="open-cursor", data=open_cursor),
+                get_live_poll("dashboard", version),
                 closed_section
             ], width=10)
         ])
     ], fluid=True)
 
+# Scan generation last written to the repositories table by this process
+repo_sync_state = {'generation': None}
+
 def get_new_pr_layout(user_data):
-    repos = list_repositories()
-    repo_options = [{'label': r['name'], 'value': r['path']} for r in repos]
+    # The scan is cached and only touches the filesystem when the repos
+    # directory changed; the select itself is served from the database.
+    repos, generation = scan_repositories()
+    if generation != repo_sync_state['generation']:
+        sync_repositories(repos)
+        repo_sync_state['generation'] = generation
+    with Session(engine) as session:
+        repo_options = [{'label': name, 'value': path} for name, path in get_repository_options(session)]
     
     return dbc.Container([
         dbc.Row([
@@ -148,11 +349,11 @@ def get_new_pr_layout(user_data):
                 dbc.Row([
                     dbc.Col([
                         dbc.Label("Source Branch"),
-                        dbc.Select(id="new-pr-source", className="mb-3")
+                        dcc.Dropdown(id="new-pr-source", placeholder="Type to search branches", className="mb-3")
                     ]),
                     dbc.Col([
                         dbc.Label("Target Branch"),
-                        dbc.Select(id="new-pr-target", className="mb-3")
+                        dcc.Dropdown(id="new-pr-target", placeholder="Type to search branches", className="mb-3")
                     ])
                 ]),
                 
@@ -170,51 +371,123 @@ def get_new_pr_layout(user_data):
         ])
     ], fluid=True)
 
+def get_file_diff_card(file_diff, file_idx, prefix=""):
+    """Builds a collapsible card for one file of a diff summary.
+    Only the header is rendered; the patch is fetched by a toggle callback
+    the first time the card is expanded."""
+    # Map change type to badge color and label
+    change_map = {'A': ('Added', 'success'), 'D': ('Deleted', 'danger'), 'M': ('Modified', 'info'), 'R': ('Renamed', 'warning')}
+    change_label, badge_color = change_map.get(file_diff['change_type'], ('Unknown', 'secondary'))
+
+    path_label = file_diff['path']
+    if file_diff['old_path'] != file_diff['path']:
+        path_label = f"{file_diff['old_path']} → {file_diff['path']}"
+
+    return dbc.Card([
+        dbc.CardHeader(
+            html.Button(
+                html.Div([
+                    html.Span(path_label, className="font-weight-bold"),
+                    html.Span(" "),
+                    dbc.Badge(change_label, color=badge_color, className="ms-2"),
+                    html.Span(" "),
+                    dbc.Badge("Binary", color="secondary", className="ms-1") if file_diff['binary'] else html.Span(),
+                    dbc.Badge(f"+{file_diff['additions']}", color="success", className="ms-1") if file_diff['additions'] > 0 else html.Span(),
+                    dbc.Badge(f"-{file_diff['deletions']}", color="danger", className="ms-1") if file_diff['deletions'] > 0 else html.Span()
+                ], style={"display": "flex", "alignItems": "center", "gap": "8px", "width": "100%"}),
+                id={"type": f"toggle-{prefix}file", "index": file_idx},
+                style={"background": "none", "border": "none", "width": "100%", "textAlign": "left", "cursor": "pointer", "padding": "0"}
+            )
+        ),
+        dbc.Collapse(
+            dbc.CardBody(id={"type": f"{prefix}file-diff-body", "index": file_idx}),
+            id={"type": f"{prefix}file-diff-collapse", "index": file_idx},
+            is_open=False,
+            className="file-diff-body"
+        ),
+        dcc.Store(id={"type": f"{prefix}file-diff-path", "index": file_idx}, data={'path': file_diff['path'], 'old_path': file_diff['old_path']})
+    ], className="mb-2")
+
+def take_diff_files(file_iter):
+    """Reads at most DIFF_MAX_FILES entries from a diff summary iterator.
+    Returns (files, truncated); the rest of the diff is never read."""
+    files = []
+    for file_diff in file_iter:
+        if len(files) == config.DIFF_MAX_FILES:
+            file_iter.close()
+            return files, True
+        files.append(file_diff)
+    return files, False
+
+def get_changes_title(file_diffs, truncated):
+    if truncated:
+        return f"Changes (showing the first {len(file_diffs)} files)"
+    return f"Changes ({len(file_diffs)} file{'s' if len(file_diffs) != 1 else ''})"
+
+def get_patch_view(patch, max_height=None):
+    """Renders a single file patch loaded by a toggle callback."""
+    if patch is None:
+        return html.P("This file is no longer part of the diff.", className="text-muted")
+    if patch['summarized'] == 'binary':
+        return html.P("Binary file not shown.", className="text-muted")
+    if patch['summarized'] == 'too_large':
+        return html.P("Diff too large to display.", className="text-muted")
+    style = {"backgroundColor": "#f5f5f5", "padding": "10px", "fontSize": "12px", "overflowX": "auto"}
+    if max_height:
+        style.update({"maxHeight": max_height, "overflowY": "auto"})
+    return html.Pre(patch['patch'], style=style)
+
+def get_comment_card(username, comment):
+    # The id lets the change feed skip comments that are already shown
+    return dbc.Card([
+        dbc.CardBody([
+            html.H6(f"{username} - {comment.created_at.strftime('%Y-%m-%d %H:%M')}", className="card-subtitle mb-2 text-muted"),
+            html.P(comment.content, className="card-text")
+        ])
+    ], id={"type": "comment-card", "index": comment.id}, className="mb-2")
+
+def get_conflicts_alert(pr, stale=False):
+    if pr.status != 'open' or stale or pr.mergeability is None or pr.mergeability.state != 'conflicts':
+        return None
+    return dbc.Alert([
+        html.P(f"This branch conflicts with {pr.target_branch} in:", className="mb-1"),
+        html.Ul([html.Li(html.Code(path)) for path in pr.mergeability.conflict_paths], className="mb-0"),
+    ], color="warning")
+
+def get_commit_item(commit):
+    return dbc.ListGroupItem([
+        html.Div([
+            html.Span(commit['subject']),
+            html.Code(commit['sha'][:7]),
+        ], className="d-flex w-100 justify-content-between"),
+        html.Small(f"{commit['author']} committed {commit['date'].strftime('%Y-%m-%d %H:%M')}", className="text-muted"),
+    ])
+
 def get_pr_detail_layout(pr_id, user_data):
     with Session(engine) as session:
         pr = session.query(PullRequest).filter_by(id=pr_id).first()
         if not pr:
             return html.Div("PR not found")
+        version = get_latest_event_id(session, pr.id)
+
+        # The merge check is left to the background job; if either branch
+        # moved since it last ran, say it is pending rather than show an
+        # outdated result
+        stale = False
+        if pr.status == 'open' and pr.mergeability is not None:
+            heads = get_branch_heads(pr.repo.path, pr.source_branch, pr.target_branch)
+            stale = heads is not None and (pr.mergeability.source_sha, pr.mergeability.target_sha) != heads
         
-        # Get structured per-file diffs
-        file_diffs = get_diff(pr.repo.path, pr.source_branch, pr.target_branch)
+        # Per-file stats only; patches are loaded on expand
+        file_diffs, truncated = take_diff_files(iter_diff_summary(pr.repo.path, pr.source_branch, pr.target_branch))
         
         # Build file diff cards
         file_diff_cards = []
         if not file_diffs:
             file_diff_cards.append(html.P("No changes found.", className="text-muted"))
         else:
-            for file_diff in file_diffs:
-                # Map change type to badge color and label
-                change_map = {'A': ('Added', 'success'), 'D': ('Deleted', 'danger'), 'M': ('Modified', 'info'), 'R': ('Renamed', 'warning')}
-                change_label, badge_color = change_map.get(file_diff['change_type'], ('Unknown', 'secondary'))
-                
-                file_idx = hash(file_diff['path']) % (10**8)
-                file_card = dbc.Card([
-                    dbc.CardHeader(
-                        html.Button(
-                            html.Div([
-                                html.Span(file_diff['path'], className="font-weight-bold"),
-                                html.Span(" "),
-                                dbc.Badge(change_label, color=badge_color, className="ms-2"),
-                                html.Span(" "),
-                                dbc.Badge(f"+{file_diff['additions']}", color="success", className="ms-1") if file_diff['additions'] > 0 else html.Span(),
-                                dbc.Badge(f"-{file_diff['deletions']}", color="danger", className="ms-1") if file_diff['deletions'] > 0 else html.Span()
-                            ], style={"display": "flex", "alignItems": "center", "gap": "8px", "width": "100%"}),
-                            id={"type": "toggle-file", "index": file_idx},
-                            style={"background": "none", "border": "none", "width": "100%", "textAlign": "left", "cursor": "pointer", "padding": "0"}
-                        )
-                    ),
-                    dbc.Collapse(
-                        dbc.CardBody([
-                            html.Pre(file_diff['patch'], style={"backgroundColor": "#f5f5f5", "padding": "10px", "fontSize": "12px", "overflowX": "auto"})
-                        ]),
-                        id={"type": "file-diff-collapse", "index": file_idx},
-                        is_open=False,
-                        className="file-diff-body"
-                    )
-                ], className="mb-2")
-                file_diff_cards.append(file_card)
+            for file_idx, file_diff in enumerate(file_diffs):
+                file_diff_cards.append(get_file_diff_card(file_diff, file_idx))
         
         merge_button = html.Div()
         action_buttons = []
@@ -223,35 +496,46 @@ def get_pr_detail_layout(pr_id, user_data):
             action_buttons.append(dbc.Button("Close Request", id={"type": "close-btn", "index": pr.id}, color="danger", className="mt-3 ms-2"))
         merge_button = html.Div(action_buttons)
 
-        # Fetch comments
-        comments_list = []
-        for comment in pr.comments:
-            comments_list.append(
-                dbc.Card([
-                    dbc.CardBody([
-                        html.H6(f"{comment.author.username} - {comment.created_at.strftime('%Y-%m-%d %H:%M')}", className="card-subtitle mb-2 text-muted"),
-                        html.P(comment.content, className="card-text")
-                    ])
-                ], className="mb-2")
-            )
-        
-        if not comments_list:
-            comments_list = [html.P("No comments yet.", className="text-muted")]
+        # Latest page of comments; older ones are loaded on demand
+        comments, comments_cursor = get_comment_page(session, pr.id, limit=config.COMMENTS_PAGE_SIZE)
+        comments_list = [get_comment_card(comment.author.username, comment) for comment in comments]
 
         return dbc.Container([
             dbc.Row([
                 dbc.Col(get_sidebar(user_data), width=2),
                 dbc.Col([
-                    html.H2(f"#{pr.id} {pr.title}", className="mt-4"),
+                    html.H2([f"#{pr.id} {pr.title}", get_mergeability_badge(pr, stale)], className="mt-4"),
                     html.P(pr.description),
+                    get_conflicts_alert(pr, stale),
                     html.Hr(),
-                    html.H4(f"Changes ({len(file_diffs)} file{'s' if len(file_diffs) != 1 else ''})"),
-                    html.Div(file_diff_cards, className="mb-3"),
+                    dbc.Tabs([
+                        dbc.Tab([
+                            html.H4(get_changes_title(file_diffs, truncated), className="mt-3"),
+                            html.Div(file_diff_cards, className="mb-3"),
+                        ], label="Files changed", tab_id="files"),
+                        # Loaded the first time the tab is opened
+                        dbc.Tab([
+                            dbc.ListGroup(id="commits-list", children=[], className="mt-3"),
+                            dbc.Button("Load more commits", id="commits-load-more", color="link",
+                                       className="mt-2 p-0", style={"display": "none"}),
+                            dcc.Store(id="commits-cursor"),
+                            dcc.Store(id="commits-loaded", data=False),
+                        ], label="Commits", tab_id="commits"),
+                    ], id="pr-tabs", active_tab="files"),
                     merge_button,
                     html.Div(id="merge-alert", className="mt-2"),
+                    dcc.Store(id="merge-job"),
+                    dcc.Interval(id="merge-poll", interval=1000, disabled=True),
                     html.Div(id="close-alert", className="mt-2"),
+                    html.Div(id="pr-live-alert", className="mt-2"),
+                    get_live_poll("pr", version),
                     html.Hr(),
                     html.H4("Comments"),
+                    dbc.Button("Load older comments", id="comments-load-older", color="link",
+                               className="mb-2 p-0", style=get_load_more_style(comments_cursor)),
+                    dcc.Store(id="comments-cursor", data=comments_cursor),
+                    html.P("No comments yet.", id="no-comments", className="text-muted",
+                           style={"display": "none"} if comments_list else {}),
                     html.Div(id="comments-container", children=comments_list, className="mb-4"),
                     dcc.Store(id="current-pr-id", data=pr.id),
                     dbc.Textarea(id="comment-textarea", placeholder="Leave a comment...", className="mb-2"),
@@ -261,6 +545,46 @@ def get_pr_detail_layout(pr_id, user_data):
             ])
         ], fluid=True)
 
+def get_snippet(snippet):
+    """Renders a search snippet, highlighting the matched terms."""
+    parts = []
+    for i, chunk in enumerate(snippet.split(SNIPPET_START)):
+        if i == 0:
+            parts.append(chunk)
+            continue
+        matched, _, rest = chunk.partition(SNIPPET_END)
+        parts.extend([html.Mark(matched), rest])
+    return html.P(parts, className="mb-1 text-muted small")
+
+def get_search_result_item(result):
+    pr = result['pr']
+    return dbc.ListGroupItem([
+        html.Div([
+            html.H5(pr.title, className="mb-1"),
+            html.Small(f"#{pr.id} opened by {pr.author.username} • {pr.status}")
+        ], className="d-flex w-100 justify-content-between"),
+        html.P(f"Repo: {pr.repo.name} | {pr.source_branch} -> {pr.target_branch}", className="mb-1"),
+        get_snippet(result['snippet'])
+    ], href=f"/pr/{pr.id}", action=True)
+
+def get_search_layout(user_data):
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col(get_sidebar(user_data), width=2),
+            dbc.Col([
+                html.H2("Search", className="mt-4"),
+                dbc.Input(id="search-query", placeholder="Search pull requests and comments...",
+                          type="search", debounce=True, className="mt-3 mb-3"),
+                dbc.ListGroup(id="search-results"),
+                html.Div([
+                    dbc.Button("Previous", id="search-prev", color="link", style={"display": "none"}),
+                    dbc.Button("Next", id="search-next", color="link", style={"display": "none"}),
+                ], className="d-flex justify-content-between"),
+                dcc.Store(id="search-page", data=0)
+            ], width=10)
+        ])
+    ], fluid=True)
+
 app.layout = html.Div([
     dcc.Location(id="url", refresh=False),
     dcc.Store(id="session-store", storage_type="session"),
@@ -280,16 +604,38 @@ app.layout = html.Div([
     State("login-password", "value"),
     prevent_initial_call=True
 )
+@instrument_callback
 def handle_login(n_clicks, username, password):
     if not username or not password:
         return dash.no_update, dbc.Alert("Please enter username and password", color="warning")
         
     with Session(engine) as session:
         user = session.query(User).filter_by(username=username).first()
-        if user and bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
-            return {'user_id': user.id, 'username': user.username, 'is_admin': user.is_admin}, ""
-        else:
+        if not user:
             return dash.no_update, dbc.Alert("Invalid credentials", color="danger")
+        user_data = {'user_id': user.id, 'username': user.username, 'is_admin': user.is_admin}
+        password_hash = user.password_hash
+
+    # bcrypt runs on the password worker pool, outside the DB session
+    try:
+        if not verify_password(password, password_hash):
+            return dash.no_update, dbc.Alert("Invalid credentials", color="danger")
+    except PasswordQueueFull:
+        return dash.no_update, dbc.Alert("Server is busy, please try again in a moment", color="warning")
+
+    # Upgrade hashes made with an old cost factor; skip it if the pool is busy
+    if needs_rehash(password_hash):
+        try:
+            new_hash = hash_password(password)
+            with Session(engine) as session:
+                session.query(User).filter_by(id=user_data['user_id']).update({'password_hash': new_hash})
+                session.commit()
+            invalidate_user(user_data['user_id'])
+        except PasswordQueueFull:
+            pass
+
+    # The browser only gets an opaque token; the session lives on the server
+    return session_store.create({'user_id': user_data['user_id']}), ""
 
 @app.callback(
     Output("signup-alert", "children"),
@@ -299,6 +645,7 @@ def handle_login(n_clicks, username, password):
     State("signup-confirm", "value"),
     prevent_initial_call=True
 )
+@instrument_callback
 def handle_signup(n_clicks, username, password, confirm):
     if not username or not password or not confirm:
         return dbc.Alert("Please fill in all fields", color="warning")
@@ -312,6 +659,8 @@ def handle_signup(n_clicks, username, password, confirm):
             return dbc.Alert("Account created! Please login.", color="success")
         else:
             return dbc.Alert("Username already exists", color="danger")
+    except PasswordQueueFull:
+        return dbc.Alert("Server is busy, please try again in a moment", color="warning")
     except Exception as e:
         return dbc.Alert(f"Error creating account: {e}", color="danger")
 
@@ -321,6 +670,7 @@ def handle_signup(n_clicks, username, password, confirm):
     Input("logout-btn", "n_clicks"),
     prevent_initial_call=True
 )
+@instrument_callback
 def handle_logout(n_clicks):
     return True
 
@@ -332,6 +682,7 @@ def handle_logout(n_clicks):
     State("session-store", "data"),
     prevent_initial_call=True
 )
+@instrument_callback
 def manage_session(login_data, logout_data, current_session):
     ctx = callback_context
     if not ctx.triggered:
@@ -342,27 +693,41 @@ def manage_session(login_data, logout_data, current_session):
     if 'login-signal' in trigger:
         return login_data
     if 'logout-signal' in trigger:
+        session_store.revoke(current_session)
         return None
         
     return dash.no_update
 
+def get_session_user(session_token):
+    """Resolves a session token to {'user_id', 'username', 'is_admin'}, or
+    None if the session is unknown, expired or revoked."""
+    session = session_store.get(session_token)
+    if not session:
+        return None
+    return get_user_info(session['user_id'])
+
 # 4. Router
 @app.callback(
     Output("page-content", "children"),
     Input("url", "pathname"),
     Input("session-store", "data")
 )
-def router(pathname, session_data):
+@instrument_callback
+def router(pathname, session_token):
     if pathname == "/signup":
-        return signup_layout
+        return get_signup_layout()
 
-    # If no session, show login
+    # If no valid session, show login
+    session_data = get_session_user(session_token)
     if not session_data:
-        return login_layout
+        return get_login_layout()
 
     # If session exists, show content
     if pathname == "/new-pr":
         return get_new_pr_layout(session_data)
+
+    if pathname == "/search":
+        return get_search_layout(session_data)
     
     if pathname and pathname.startswith("/pr/"):
         try:
@@ -373,18 +738,38 @@ def router(pathname, session_data):
 
     return get_dashboard_layout(session_data)
 
-# Populate branches when repo is selected
+# Populate branches when repo is selected, and filter them on the server
+# as the user types. Only a page of matches is sent to each dropdown.
+def get_branch_options(repo_path, search_value, selected):
+    branches, total = search_branches(repo_path, search_value, limit=config.BRANCH_OPTIONS_LIMIT)
+    options = [{'label': b, 'value': b} for b in branches]
+    # Keep the current selection in the options or the dropdown clears it
+    if selected and selected not in branches:
+        options.insert(0, {'label': selected, 'value': selected})
+    if total > len(branches):
+        options.append({'label': f"... {total - len(branches)} more, keep typing to narrow down", 'value': '', 'disabled': True})
+    return options
+
 @app.callback(
     Output("new-pr-source", "options"),
     Output("new-pr-target", "options"),
-    Input("new-pr-repo", "value")
+    Input("new-pr-repo", "value"),
+    Input("new-pr-source", "search_value"),
+    Input("new-pr-target", "search_value"),
+    State("new-pr-source", "value"),
+    State("new-pr-target", "value")
 )
-def update_branches(repo_path):
+@instrument_callback
+def update_branches(repo_path, source_search, target_search, source, target):
     if not repo_path:
         return [], []
-    branches = get_repo_branches(repo_path)
-    options = [{'label': b, 'value': b} for b in branches]
-    return options, options
+
+    triggered = callback_context.triggered_id
+    if triggered == "new-pr-source":
+        return get_branch_options(repo_path, source_search, source), dash.no_update
+    if triggered == "new-pr-target":
+        return dash.no_update, get_branch_options(repo_path, target_search, target)
+    return get_branch_options(repo_path, None, source), get_branch_options(repo_path, None, target)
 
 # Show diff preview when source/target branches are selected
 @app.callback(
@@ -394,12 +779,13 @@ def update_branches(repo_path):
     State("new-pr-repo", "value"),
     prevent_initial_call=True
 )
+@instrument_callback
 def show_diff_preview(source_branch, target_branch, repo_path):
     if not repo_path or not source_branch or not target_branch:
         return html.Div()
     
-    # Get structured per-file diffs
-    file_diffs = get_diff(repo_path, source_branch, target_branch)
+    # Per-file stats only; patches are loaded on expand
+    file_diffs, truncated = take_diff_files(iter_diff_summary(repo_path, source_branch, target_branch))
     
     if not file_diffs:
         return html.Div([
@@ -408,40 +794,11 @@ def show_diff_preview(source_branch, target_branch, repo_path):
     
     # Build file diff cards for preview
     file_diff_cards = []
-    for idx, file_diff in enumerate(file_diffs):
-        # Map change type to badge color and label
-        change_map = {'A': ('Added', 'success'), 'D': ('Deleted', 'danger'), 'M': ('Modified', 'info'), 'R': ('Renamed', 'warning')}
-        change_label, badge_color = change_map.get(file_diff['change_type'], ('Unknown', 'secondary'))
-        
-        file_idx = hash(f"preview-{file_diff['path']}") % (10**8)
-        file_card = dbc.Card([
-            dbc.CardHeader(
-                html.Button(
-                    html.Div([
-                        html.Span(file_diff['path'], className="font-weight-bold"),
-                        html.Span(" "),
-                        dbc.Badge(change_label, color=badge_color, className="ms-2"),
-                        html.Span(" "),
-                        dbc.Badge(f"+{file_diff['additions']}", color="success", className="ms-1") if file_diff['additions'] > 0 else html.Span(),
-                        dbc.Badge(f"-{file_diff['deletions']}", color="danger", className="ms-1") if file_diff['deletions'] > 0 else html.Span()
-                    ], style={"display": "flex", "alignItems": "center", "gap": "8px", "width": "100%"}),
-                    id={"type": "toggle-preview-file", "index": file_idx},
-                    style={"background": "none", "border": "none", "width": "100%", "textAlign": "left", "cursor": "pointer", "padding": "0"}
-                )
-            ),
-            dbc.Collapse(
-                dbc.CardBody([
-                    html.Pre(file_diff['patch'], style={"backgroundColor": "#f5f5f5", "padding": "10px", "fontSize": "12px", "overflowX": "auto", "maxHeight": "300px", "overflowY": "auto"})
-                ]),
-                id={"type": "preview-file-diff-collapse", "index": file_idx},
-                is_open=False,
-                className="file-diff-body"
-            )
-        ], className="mb-2")
-        file_diff_cards.append(file_card)
+    for file_idx, file_diff in enumerate(file_diffs):
+        file_diff_cards.append(get_file_diff_card(file_diff, file_idx, prefix="preview-"))
     
     return html.Div([
-        html.H5(f"Changes ({len(file_diffs)} file{'s' if len(file_diffs) != 1 else ''})", className="mt-3"),
+        html.H5(get_changes_title(file_diffs, truncated), className="mt-3"),
         html.Div(file_diff_cards)
     ])
 
@@ -456,10 +813,12 @@ def show_diff_preview(source_branch, target_branch, repo_path):
     State("new-pr-desc", "value"),
     State("session-store", "data")
 )
-def create_pr(n_clicks, repo_path, source, target, title, desc, session_data):
+@instrument_callback
+def create_pr(n_clicks, repo_path, source, target, title, desc, session_token):
     if not n_clicks:
         return ""
     
+    session_data = get_session_user(session_token)
     if not session_data:
         return dbc.Alert("You must be logged in to create a PR", color="danger")
     
@@ -484,39 +843,130 @@ def create_pr(n_clicks, repo_path, source, target, title, desc, session_data):
             target_branch=target
         )
         session.add(pr)
+        session.flush()
+        record_event(session, 'pr_created', pr.id)
         session.commit()
-        
+
+        # Stats are computed once here so the dashboard never has to diff,
+        # even with the scheduler off; the numstat summary is cheap and
+        # cached. The merge check is left to refresh_open_prs.
+        heads = get_branch_heads(repo.path, source, target)
+        if heads is not None and refresh_pr_stats(session, pr, heads):
+            session.commit()
+
     return dbc.Alert("Pull Request Created Successfully!", color="success")
 
-# Toggle file diff collapse when header is clicked (pattern-matching)
+# Toggle file diff collapse when header is clicked (pattern-matching).
+# The patch is loaded the first time the file is expanded.
 @app.callback(
     Output({"type": "file-diff-collapse", "index": MATCH}, "is_open"),
+    Output({"type": "file-diff-body", "index": MATCH}, "children"),
     Input({"type": "toggle-file", "index": MATCH}, "n_clicks"),
     State({"type": "file-diff-collapse", "index": MATCH}, "is_open"),
+    State({"type": "file-diff-body", "index": MATCH}, "children"),
+    State({"type": "file-diff-path", "index": MATCH}, "data"),
+    State("current-pr-id", "data"),
+    State("session-store", "data"),
     prevent_initial_call=True
 )
-def toggle_file_collapse(n_clicks, is_open):
-    return not is_open if is_open is not None else True
+@instrument_callback
+def toggle_file_collapse(n_clicks, is_open, body, file_info, pr_id, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    is_open = not is_open if is_open is not None else True
+    if not is_open or body:
+        return is_open, dash.no_update
+
+    with Session(engine) as session:
+        pr = session.query(PullRequest).filter_by(id=pr_id).first()
+        if not pr:
+            return is_open, html.P("PR not found", className="text-muted")
+        patch = get_file_patch(pr.repo.path, pr.source_branch, pr.target_branch, file_info['path'], file_info['old_path'])
+
+    return is_open, get_patch_view(patch)
 
 # Toggle preview file diff collapse when header is clicked (pattern-matching)
 @app.callback(
     Output({"type": "preview-file-diff-collapse", "index": MATCH}, "is_open"),
+    Output({"type": "preview-file-diff-body", "index": MATCH}, "children"),
     Input({"type": "toggle-preview-file", "index": MATCH}, "n_clicks"),
     State({"type": "preview-file-diff-collapse", "index": MATCH}, "is_open"),
+    State({"type": "preview-file-diff-body", "index": MATCH}, "children"),
+    State({"type": "preview-file-diff-path", "index": MATCH}, "data"),
+    State("new-pr-repo", "value"),
+    State("new-pr-source", "value"),
+    State("new-pr-target", "value"),
+    State("session-store", "data"),
     prevent_initial_call=True
 )
-def toggle_preview_file_collapse(n_clicks, is_open):
-    return not is_open if is_open is not None else True
+@instrument_callback
+def toggle_preview_file_collapse(n_clicks, is_open, body, file_info, repo_path, source_branch, target_branch, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    is_open = not is_open if is_open is not None else True
+    if not is_open or body:
+        return is_open, dash.no_update
 
-# Toggle closed requests dropdown
+    # repo_path comes from the browser; only diff repositories GitWatch knows
+    with Session(engine) as session:
+        if repo_path not in {path for _, path in get_repository_options(session)}:
+            raise PreventUpdate
+    patch = get_file_patch(repo_path, source_branch, target_branch, file_info['path'], file_info['old_path'])
+    return is_open, get_patch_view(patch, max_height="300px")
+
+# Load the next page of open requests
+@app.callback(
+    Output("open-list", "children"),
+    Output("open-cursor", "data"),
+    Output("open-load-more", "style"),
+    Input("open-load-more", "n_clicks"),
+    State("open-cursor", "data"),
+    State("session-store", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def load_more_open(n_clicks, cursor, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    if not cursor:
+        return dash.no_update, dash.no_update, get_load_more_style(None)
+    items, next_cursor = load_pr_page('open', cursor)
+    patch = Patch()
+    patch.extend(items)
+    return patch, next_cursor, get_load_more_style(next_cursor)
+
+# Toggle closed requests dropdown. The first page is loaded the first time
+# it is opened, later pages through the "Load more" button.
 @app.callback(
     Output("closed-collapse", "is_open"),
+    Output("closed-list", "children"),
+    Output("closed-cursor", "data"),
+    Output("closed-load-more", "style"),
     Input("closed-toggle", "n_clicks"),
+    Input("closed-load-more", "n_clicks"),
     State("closed-collapse", "is_open"),
+    State("closed-cursor", "data"),
+    State("session-store", "data"),
     prevent_initial_call=True
 )
-def toggle_closed_collapse(n_clicks, is_open):
-    return not is_open if is_open is not None else True
+@instrument_callback
+def toggle_closed_collapse(toggle_clicks, load_more_clicks, is_open, cursor_state, session_token):
+    if not get_session_user(session_token) or not isinstance(cursor_state, dict):
+        raise PreventUpdate
+    if callback_context.triggered_id == "closed-toggle":
+        is_open = not is_open if is_open is not None else True
+        if not is_open or cursor_state.get('loaded'):
+            return is_open, dash.no_update, dash.no_update, dash.no_update
+        cursor = None
+    else:
+        cursor = cursor_state.get('cursor')
+        if not cursor:
+            return dash.no_update, dash.no_update, dash.no_update, get_load_more_style(None)
+
+    items, next_cursor = load_pr_page('closed', cursor)
+    patch = Patch()
+    patch.extend(items)
+    return is_open, patch, {'loaded': True, 'cursor': next_cursor}, get_load_more_style(next_cursor)
 
 # Close PR
 @app.callback(
@@ -524,7 +974,8 @@ def toggle_closed_collapse(n_clicks, is_open):
     Input({"type": "close-btn", "index": ALL}, "n_clicks"),
     State("session-store", "data")
 )
-def close_pr(n_clicks, session_data):
+@instrument_callback
+def close_pr(n_clicks, session_token):
     ctx = callback_context
     if not ctx.triggered:
         return ""
@@ -538,6 +989,10 @@ def close_pr(n_clicks, session_data):
         id_str = prop_id.split('.')[0]
         id_dict = json.loads(id_str)
         pr_id = id_dict['index']
+
+        session_data = get_session_user(session_token)
+        if not session_data or not session_data['is_admin']:
+            return dbc.Alert("Only admins can close requests.", color="danger")
         
         with Session(engine) as session:
             pr = session.query(PullRequest).filter_by(id=pr_id).first()
@@ -545,6 +1000,7 @@ def close_pr(n_clicks, session_data):
                 return dbc.Alert("PR not found", color="danger")
             
             pr.status = 'closed'
+            record_event(session, 'pr_status', pr.id, status='closed')
             session.commit()
             return dbc.Alert("Request closed successfully!", color="success")
 
@@ -552,107 +1008,406 @@ def close_pr(n_clicks, session_data):
         return dbc.Alert(f"Error: {e}", color="danger")
 
 # Merge PR
+def mark_pr_merged(pr_id):
+    """Returns the merge job completion hook that records a merged PR."""
+    def on_done(success, msg):
+        if not success:
+            return
+        with Session(engine) as session:
+            pr = session.query(PullRequest).filter_by(id=pr_id).first()
+            if pr:
+                pr.status = 'merged'
+                record_event(session, 'pr_status', pr.id, status='merged')
+                session.commit()
+    return on_done
+
 @app.callback(
     Output("merge-alert", "children"),
+    Output("merge-job", "data"),
+    Output("merge-poll", "disabled"),
     Input({"type": "merge-btn", "index": ALL}, "n_clicks"),
     State("session-store", "data")
 )
-def merge_pr(n_clicks, session_data):
+@instrument_callback
+def merge_pr(n_clicks, session_token):
     ctx = callback_context
     if not ctx.triggered:
-        return ""
+        return "", dash.no_update, dash.no_update
     
-    button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    # Parse ID from string if needed, but dash gives us the dict structure in triggered_id if we use pattern matching correctly? 
-    # Actually ctx.triggered_id is better in newer dash, but let's stick to safe parsing
     import json
     try:
         # triggered_id is a string like '{"index":1,"type":"merge-btn"}'
         prop_id = ctx.triggered[0]['prop_id']
         if "merge-btn" not in prop_id:
-            return ""
+            return "", dash.no_update, dash.no_update
         
-        # We need to extract the index. 
-        # Since we used ALL, n_clicks is a list. We need to find which one was clicked.
-        # But wait, if we use ALL, the callback fires when ANY of them change.
-        # We can find the one that is not None?
-        
-        # Let's simplify: The triggered prop_id contains the JSON string of the ID.
+        # The triggered prop_id contains the JSON string of the ID.
         id_str = prop_id.split('.')[0]
         id_dict = json.loads(id_str)
         pr_id = id_dict['index']
-        
-        # Check if actually clicked (n_clicks > 0)
-        # We need to find the value in n_clicks list corresponding to this ID? 
-        # Actually, let's just check if the specific button was the trigger.
+
+        session_data = get_session_user(session_token)
+        if not session_data or not session_data['is_admin']:
+            return dbc.Alert("Only admins can merge requests.", color="danger"), dash.no_update, dash.no_update
         
         with Session(engine) as session:
             pr = session.query(PullRequest).filter_by(id=pr_id).first()
             if not pr:
-                return dbc.Alert("PR not found", color="danger")
-            
-            success, msg = merge_branch(pr.repo.path, pr.source_branch, pr.target_branch)
+                return dbc.Alert("PR not found", color="danger"), dash.no_update, dash.no_update
             
-            if success:
-                pr.status = 'merged'
-                session.commit()
-                return dbc.Alert(f"Merged! {msg}", color="success")
-            else:
-                return dbc.Alert(f"Merge failed: {msg}", color="danger")
+            # The merge runs on the repo's lane in the merge worker pool;
+            # poll_merge_job reports the result.
+            job_id = merge_queue.submit(
+                pr.repo.path,
+                merge_branch,
+                args=(pr.repo.path, pr.source_branch, pr.target_branch),
+                key=('merge', pr.id),
+                on_done=mark_pr_merged(pr.id)
+            )
+
+        return dbc.Alert("Merge queued...", color="info"), {'job_id': job_id, 'pr_id': pr_id}, False
 
     except Exception as e:
-        return dbc.Alert(f"Error: {e}", color="danger")
+        return dbc.Alert(f"Error: {e}", color="danger"), dash.no_update, dash.no_update
+
+# Poll a queued merge until it finishes
+@app.callback(
+    Output("merge-alert", "children", allow_duplicate=True),
+    Output("merge-poll", "disabled", allow_duplicate=True),
+    Input("merge-poll", "n_intervals"),
+    State("merge-job", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def poll_merge_job(n_intervals, job_data):
+    if not job_data:
+        return dash.no_update, True
+
+    job = merge_queue.get_job(job_data['job_id'])
+    if job is None:
+        # Job ran in another process or was pruned; fall back to the PR status
+        with Session(engine) as session:
+            pr = session.query(PullRequest).filter_by(id=job_data['pr_id']).first()
+            if pr and pr.status == 'merged':
+                return dbc.Alert("Merged!", color="success"), True
+        return dbc.Alert("Merge status unknown, reload the page to check.", color="warning"), True
+
+    if job['status'] == 'queued':
+        return dbc.Alert("Merge queued...", color="info"), False
+    if job['status'] == 'running':
+        return dbc.Alert("Merging...", color="info"), False
+    if job['status'] == 'succeeded':
+        return dbc.Alert(f"Merged! {job['message']}", color="success"), True
+    return dbc.Alert(f"Merge failed: {job['message']}", color="danger"), True
 
 # Post Comment
 @app.callback(
     Output("comments-container", "children"),
     Output("comment-alert", "children"),
     Output("comment-textarea", "value"),
+    Output("no-comments", "style"),
     Input("post-comment-btn", "n_clicks"),
     State("comment-textarea", "value"),
     State("current-pr-id", "data"),
     State("session-store", "data"),
     prevent_initial_call=True
 )
-def post_comment(n_clicks, comment_text, pr_id, session_data):
+@instrument_callback
+def post_comment(n_clicks, comment_text, pr_id, session_token):
     try:
+        session_data = get_session_user(session_token)
         if not session_data:
-            return dash.no_update, dbc.Alert("You must be logged in to post a comment", color="danger"), dash.no_update
+            return dash.no_update, dbc.Alert("You must be logged in to post a comment", color="danger"), dash.no_update, dash.no_update
         
         if not comment_text or not comment_text.strip():
-            return dash.no_update, dbc.Alert("Comment cannot be empty", color="warning"), dash.no_update
+            return dash.no_update, dbc.Alert("Comment cannot be empty", color="warning"), dash.no_update, dash.no_update
 
         with Session(engine) as session:
-            pr = session.query(PullRequest).filter_by(id=pr_id).first()
-            if not pr:
-                return dash.no_update, dbc.Alert("PR not found", color="danger"), dash.no_update
+            if session.get(PullRequest, pr_id) is None:
+                return dash.no_update, dbc.Alert("PR not found", color="danger"), dash.no_update, dash.no_update
             
             comment = Comment(
-                pr_id=pr.id,
+                pr_id=pr_id,
                 user_id=session_data['user_id'],
-                content=comment_text
+                content=comment_text,
+                created_at=datetime.utcnow()
             )
             session.add(comment)
+            session.flush()
+            record_event(session, 'comment', pr_id, comment_id=comment.id)
+            # Built before commit, which would expire the loaded attributes
+            card = get_comment_card(session_data['username'], comment)
             session.commit()
-            
-            # Refresh comments list
-            updated_pr = session.query(PullRequest).filter_by(id=pr_id).first()
-            comments_list = []
-            for c in updated_pr.comments:
-                comments_list.append(
-                    dbc.Card([
-                        dbc.CardBody([
-                            html.H6(f"{c.author.username} - {c.created_at.strftime('%Y-%m-%d %H:%M')}", className="card-subtitle mb-2 text-muted"),
-                            html.P(c.content, className="card-text")
-                        ])
-                    ], className="mb-2")
-                )
-            
-            return comments_list, dbc.Alert("Comment posted!", color="success"), ""
+
+            # Append just the new card; the rest of the thread stays in the browser
+            comments = Patch()
+            comments.append(card)
+            return comments, dbc.Alert("Comment posted!", color="success"), "", {"display": "none"}
 
     except Exception as e:
-        return dash.no_update, dbc.Alert(f"Error: {e}", color="danger"), dash.no_update
+        return dash.no_update, dbc.Alert(f"Error: {e}", color="danger"), dash.no_update, dash.no_update
+
+# Load older comments
+@app.callback(
+    Output("comments-container", "children", allow_duplicate=True),
+    Output("comments-cursor", "data"),
+    Output("comments-load-older", "style"),
+    Input("comments-load-older", "n_clicks"),
+    State("comments-cursor", "data"),
+    State("current-pr-id", "data"),
+    State("session-store", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def load_older_comments(n_clicks, cursor, pr_id, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    if not cursor:
+        return dash.no_update, dash.no_update, get_load_more_style(None)
+
+    with Session(engine) as session:
+        comments, next_cursor = get_comment_page(session, pr_id, cursor, limit=config.COMMENTS_PAGE_SIZE)
+        cards = [get_comment_card(comment.author.username, comment) for comment in comments]
+
+    # Prepend newest-first so the page ends up in chronological order
+    patch = Patch()
+    for card in reversed(cards):
+        patch.prepend(card)
+    return patch, next_cursor, get_load_more_style(next_cursor)
+
+# Commits tab: first page when the tab is opened, then older pages on demand
+@app.callback(
+    Output("commits-list", "children"),
+    Output("commits-cursor", "data"),
+    Output("commits-load-more", "style"),
+    Output("commits-loaded", "data"),
+    Input("pr-tabs", "active_tab"),
+    Input("commits-load-more", "n_clicks"),
+    State("commits-cursor", "data"),
+    State("commits-loaded", "data"),
+    State("current-pr-id", "data"),
+    State("session-store", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def load_commits(active_tab, n_clicks, cursor, loaded, pr_id, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    if callback_context.triggered_id == "pr-tabs":
+        if active_tab != "commits" or loaded:
+            raise PreventUpdate
+        cursor = None
+    elif not cursor:
+        return dash.no_update, dash.no_update, get_load_more_style(None), dash.no_update
+
+    with Session(engine) as session:
+        pr = session.get(PullRequest, pr_id)
+        if not pr:
+            raise PreventUpdate
+        repo_path, source, target = pr.repo.path, pr.source_branch, pr.target_branch
+
+    commits, next_cursor = get_commit_page(repo_path, source, target, cursor, limit=config.COMMITS_PAGE_SIZE)
+    patch = Patch()
+    if not commits and not cursor:
+        patch.append(html.P("No commits to show.", className="text-muted"))
+    for commit in commits:
+        patch.append(get_commit_item(commit))
+    return patch, next_cursor, get_load_more_style(next_cursor), True
+
+# Search
+@app.callback(
+    Output("search-results", "children"),
+    Output("search-page", "data"),
+    Output("search-prev", "style"),
+    Output("search-next", "style"),
+    Input("search-query", "value"),
+    Input("search-prev", "n_clicks"),
+    Input("search-next", "n_clicks"),
+    State("search-page", "data"),
+    State("session-store", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def run_search(query, prev_clicks, next_clicks, page, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    trigger = callback_context.triggered_id
+    page = page or 0
+    if trigger == "search-next":
+        page += 1
+    elif trigger == "search-prev":
+        page = max(0, page - 1)
+    else:
+        page = 0
+
+    hidden = {"display": "none"}
+    if not query or not query.strip():
+        return [], 0, hidden, hidden
+
+    limit = config.SEARCH_PAGE_SIZE
+    with Session(engine) as session:
+        results, has_more, truncated = search_prs(session, query, offset=page * limit, limit=limit)
+        items = [get_search_result_item(result) for result in results]
+    if not items:
+        items = [dbc.ListGroupItem("No matching pull requests.")]
+    if truncated:
+        items.insert(0, dbc.ListGroupItem(
+            f"Too many matches: only the newest {config.SEARCH_MAX_HITS} were ranked. Add words to narrow the search.",
+            color="light", className="small text-muted"
+        ))
+    return items, page, {} if page else hidden, {} if has_more else hidden
+
+@app.server.route('/api/search')
+def search_api():
+    """JSON search: /api/search?q=...&page=0, authorized with the session
+    token as a bearer token."""
+    auth = flask.request.headers.get('Authorization', '')
+    token = auth[len('Bearer '):] if auth.startswith('Bearer ') else None
+    if not get_session_user(token):
+        return flask.jsonify({'error': 'unauthorized'}), 401
+
+    query = flask.request.args.get('q', '')
+    try:
+        page = max(0, int(flask.request.args.get('page', 0)))
+    except ValueError:
+        return flask.jsonify({'error': 'page must be an integer'}), 400
+
+    limit = config.SEARCH_PAGE_SIZE
+    with Session(engine) as session:
+        results, has_more, truncated = search_prs(session, query, offset=page * limit, limit=limit)
+        payload = [{
+            'id': r['pr'].id,
+            'title': r['pr'].title,
+            'status': r['pr'].status,
+            'repo': r['pr'].repo.name,
+            'source_branch': r['pr'].source_branch,
+            'target_branch': r['pr'].target_branch,
+            'author': r['pr'].author.username,
+            'created_at': r['pr'].created_at.isoformat() if r['pr'].created_at else None,
+            'snippet': r['snippet'].replace(SNIPPET_START, '').replace(SNIPPET_END, ''),
+        } for r in results]
+    return flask.jsonify({'query': query, 'page': page, 'results': payload, 'has_more': has_more, 'truncated': truncated})
+
+# Live updates: the poll only compares version numbers, which is a single
+# indexed lookup and an empty response while nothing changes. New events are
+# then applied to the page as partial updates.
+@app.callback(
+    Output("dashboard-latest", "data"),
+    Input("dashboard-poll", "n_intervals"),
+    State("dashboard-version", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def poll_dashboard(n_intervals, version):
+    with Session(engine) as session:
+        latest = get_latest_event_id(session)
+    if latest <= (version or 0):
+        raise PreventUpdate
+    return latest
+
+@app.callback(
+    Output("open-list", "children", allow_duplicate=True),
+    Output({"type": "open-pr", "index": ALL}, "style"),
+    Output("open-empty", "style"),
+    Output("dashboard-version", "data"),
+    Input("dashboard-latest", "data"),
+    State("dashboard-version", "data"),
+    State({"type": "open-pr", "index": ALL}, "id"),
+    State("session-store", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def apply_dashboard_events(latest, version, shown_ids, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    shown = [item_id['index'] for item_id in shown_ids]
+    with Session(engine) as session:
+        events = get_events(session, version or 0, latest)
+        if not events:
+            raise PreventUpdate
+        created = {e.pr_id for e in events if e.kind == 'pr_created'} - set(shown)
+        finished = {e.pr_id for e in events if e.kind == 'pr_status'}
+        new_prs = []
+        if created:
+            new_prs = (
+                session.query(PullRequest)
+                .options(joinedload(PullRequest.author), joinedload(PullRequest.repo), joinedload(PullRequest.stats),
+                         joinedload(PullRequest.mergeability))
+                .filter(PullRequest.id.in_(created), PullRequest.status == 'open')
+                .order_by(PullRequest.created_at, PullRequest.id)
+                .all()
+            )
+        new_items = [get_pr_list_item(pr, live=True) for pr in new_prs]
+
+    # Oldest first, so the newest PR ends up on top
+    items = Patch()
+    for item in new_items:
+        items.prepend(item)
+    styles = [{"display": "none"} if pr_id in finished else dash.no_update for pr_id in shown]
+    empty_style = {"display": "none"} if new_items else dash.no_update
+    # Events past the page limit are picked up on the next poll
+    return items, styles, empty_style, events[-1].id
+
+@app.callback(
+    Output("pr-latest", "data"),
+    Input("pr-poll", "n_intervals"),
+    State("pr-version", "data"),
+    State("current-pr-id", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def poll_pr(n_intervals, version, pr_id):
+    with Session(engine) as session:
+        latest = get_latest_event_id(session, pr_id)
+    if latest <= (version or 0):
+        raise PreventUpdate
+    return latest
+
+@app.callback(
+    Output("comments-container", "children", allow_duplicate=True),
+    Output("no-comments", "style", allow_duplicate=True),
+    Output("pr-live-alert", "children"),
+    Output("pr-version", "data"),
+    Input("pr-latest", "data"),
+    State("pr-version", "data"),
+    State("current-pr-id", "data"),
+    State({"type": "comment-card", "index": ALL}, "id"),
+    State("session-store", "data"),
+    prevent_initial_call=True
+)
+@instrument_callback
+def apply_pr_events(latest, version, pr_id, shown_ids, session_token):
+    if not get_session_user(session_token):
+        raise PreventUpdate
+    shown = {card_id['index'] for card_id in shown_ids}
+    with Session(engine) as session:
+        events = get_events(session, version or 0, latest, pr_id=pr_id)
+        if not events:
+            raise PreventUpdate
+        comment_ids = [e.comment_id for e in events if e.kind == 'comment' and e.comment_id not in shown]
+        statuses = [e.status for e in events if e.kind == 'pr_status']
+        cards = []
+        if comment_ids:
+            comments = (
+                session.query(Comment)
+                .options(joinedload(Comment.author))
+                .filter(Comment.id.in_(comment_ids))
+                .order_by(Comment.created_at, Comment.id)
+                .all()
+            )
+            cards = [get_comment_card(comment.author.username, comment) for comment in comments]
+
+    patch = Patch()
+    for card in cards:
+        patch.append(card)
+    alert = dash.no_update
+    if statuses:
+        alert = dbc.Alert(f"This pull request was {statuses[-1]}. Reload to see the latest state.", color="info")
+    return patch, {"display": "none"} if cards else dash.no_update, alert, events[-1].id
 
 if __name__ == "__main__":
+    # Development server. In production run wsgi.py under gunicorn instead.
+    bootstrap()
+    scheduler.start()
     port = int(os.environ.get('PORT', 9000))
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,102 @@
+"""Measures comment insert throughput under parallel writers.
+
+Runs the same workload against a default SQLite engine (rollback journal)
+and against the tuned engine from db.create_db_engine (WAL, busy timeout),
+each on a fresh database in a temporary directory:
+
+    python benchmarks/bench_db_writes.py --threads 16 --writes 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GITWATCH_DATA_DIR', tempfile.mkdtemp(prefix='gitwatch-bench-'))
+os.environ.setdefault('GITWATCH_REPOS_PATH', os.path.join(os.environ['GITWATCH_DATA_DIR'], 'repos'))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import db
+
+
+def seed(engine):
+    db.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        user = db.User(username='bench', password_hash='x')
+        repo = db.Repository(name='bench', path='/tmp/bench')
+        session.add_all([user, repo])
+        session.commit()
+        pr = db.PullRequest(title='bench', author_id=user.id, repo_id=repo.id, source_branch='feature')
+        session.add(pr)
+        session.commit()
+        return user.id, pr.id
+
+
+def run(engine, threads, writes):
+    user_id, pr_id = seed(engine)
+    Session = sessionmaker(bind=engine)
+    errors = []
+    start_barrier = threading.Barrier(threads)
+
+    def writer():
+        start_barrier.wait()
+        for i in range(writes):
+            try:
+                with Session() as session:
+                    session.add(db.Comment(pr_id=pr_id, user_id=user_id, content=f"comment {i}"))
+                    session.commit()
+            except Exception as e:
+                errors.append(str(e))
+
+    workers = [threading.Thread(target=writer) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    committed = threads * writes - len(errors)
+    return {
+        'threads': threads,
+        'writes': threads * writes,
+        'committed': committed,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'writes_per_second': round(committed / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200, help="commits per thread")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='gitwatch-bench-db-')
+    baseline_url = f"sqlite:///{os.path.join(workdir, 'baseline.db')}"
+    tuned_url = f"sqlite:///{os.path.join(workdir, 'tuned.db')}"
+
+    results = {
+        # What db.py used to do: no pragmas, default pool and 5s driver timeout
+        'baseline': run(create_engine(baseline_url), args.threads, args.writes),
+        'tuned': run(db.create_db_engine(tuned_url), args.threads, args.writes),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(f"{name:>8}: {result['writes_per_second']:>8} writes/s, "
+              f"{result['errors']} errors, {result['seconds']}s for {result['writes']} writes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Measures search latency over a large seeded database.
+
+Fills a fresh SQLite database with synthetic pull requests and comments
+(the FTS5 triggers index them as they are inserted), then times
+db.search_prs for rare, common and prefix queries with the FTS index and
+with the LIKE fallback:
+
+    python benchmarks/bench_search.py --prs 100000 --comments 1000000
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GITWATCH_DATA_DIR', tempfile.mkdtemp(prefix='gitwatch-bench-'))
+os.environ.setdefault('GITWATCH_REPOS_PATH', os.path.join(os.environ['GITWATCH_DATA_DIR'], 'repos'))
+os.environ.setdefault('GITWATCH_METRICS_SLOW_SECONDS', '0')
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import db
+import migrations
+
+
+def make_vocabulary(rng, size):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+
+def sentence(rng, vocabulary, cum_weights, words):
+    return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=words))
+
+
+def seed(engine, args, rng):
+    vocabulary = make_vocabulary(rng, args.vocabulary)
+    # Zipf-like: a few very common words and a long tail of rare ones
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    started = datetime(2020, 1, 1)
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, username, password_hash, is_admin) VALUES (1, 'bench', 'x', 0)"))
+        conn.execute(text("INSERT INTO repositories (id, name, path) VALUES (1, 'bench', '/tmp/bench')"))
+
+    batch = 10000
+    for first in range(0, args.prs, batch):
+        rows = [{
+            'id': i + 1,
+            'title': sentence(rng, vocabulary, weights, 6),
+            'description': sentence(rng, vocabulary, weights, 40),
+            'created_at': started + timedelta(minutes=i),
+            'status': rng.choice(['open', 'closed', 'merged']),
+        } for i in range(first, min(first + batch, args.prs))]
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO pull_requests (id, title, description, author_id, repo_id, source_branch, "
+                "target_branch, status, created_at) VALUES (:id, :title, :description, 1, 1, 'feature', "
+                "'main', :status, :created_at)"
+            ), rows)
+
+    for first in range(0, args.comments, batch):
+        rows = [{
+            'pr_id': rng.randint(1, args.prs),
+            'content': sentence(rng, vocabulary, weights, 25),
+            'created_at': started + timedelta(seconds=i),
+        } for i in range(first, min(first + batch, args.comments))]
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO comments (pr_id, user_id, content, created_at) VALUES (:pr_id, 1, :content, :created_at)"
+            ), rows)
+    return vocabulary
+
+
+def time_queries(Session, queries, repeat):
+    results = {}
+    for name, query in queries.items():
+        samples = []
+        with Session() as session:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                hits, _, truncated = db.search_prs(session, query, limit=20)
+                samples.append(time.perf_counter() - started)
+        results[name] = {
+            'query': query,
+            'hits': len(hits),
+            'truncated': truncated,
+            'median_ms': round(statistics.median(samples) * 1000, 2),
+            'max_ms': round(max(samples) * 1000, 2),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prs', type=int, default=100000)
+    parser.add_argument('--comments', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=20000, help="distinct words in the generated text")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-like', action='store_true', help="don't time the LIKE fallback")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='gitwatch-bench-search-'), 'search.db')}"
+    engine = db.create_db_engine(url)
+    migrations.upgrade(engine)
+
+    started = time.perf_counter()
+    vocabulary = seed(engine, args, rng)
+    seed_seconds = time.perf_counter() - started
+
+    queries = {
+        'common word': vocabulary[0],
+        'rare word': vocabulary[-1],
+        'two words': f"{vocabulary[1]} {vocabulary[50]}",
+        'prefix': vocabulary[5][:3],
+        'no match': 'zzzzzzzzzzzz',
+    }
+    Session = sessionmaker(bind=engine)
+    results = {'fts': time_queries(Session, queries, args.repeat)}
+    if not args.skip_like:
+        db._search_index_available[str(engine.url)] = False
+        results['like'] = time_queries(Session, queries, max(1, args.repeat // 5))
+
+    report = {'prs': args.prs, 'comments': args.comments, 'seed_seconds': round(seed_seconds, 1), 'results': results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Seeded {args.prs} PRs and {args.comments} comments in {report['seed_seconds']}s")
+    for backend, timings in results.items():
+        for name, result in timings.items():
+            print(f"{backend:>5} {name:<12} {result['median_ms']:>10} ms median, "
+                  f"{result['max_ms']:>10} ms max, {result['hits']} results"
+                  f"{' (truncated)' if result['truncated'] else ''}")
+
+
+if __name__ == '__main__':
+    main()
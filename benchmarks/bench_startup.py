@@ -0,0 +1,158 @@
+"""Measures how long a new GitWatch process takes to start.
+
+Each run starts fresh Python processes under `python -X importtime` that
+import app and call bootstrap(): first against an empty data directory
+(migrations and the default admin are created), then again against the
+same directory, which is what a worker or container restart does. Reports
+import and bootstrap times, the slowest modules imported by app, and
+which heavy modules are deferred until first use:
+
+    python benchmarks/bench_startup.py --output before.json
+    python benchmarks/bench_startup.py --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be imported once they are needed
+DEFERRED_MODULES = ('git', 'pandas', 'numpy')
+
+CHILD = """
+import sys, time, json
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.bootstrap()
+done = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'bootstrap_seconds': done - imported,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+""" % (DEFERRED_MODULES,)
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+
+def direct_imports_of(stderr, parent):
+    """Returns {module: cumulative_us} for the modules imported directly by
+    parent. -X importtime prints children before their parent, one level
+    deeper."""
+    result = {}
+    pending = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative_us, indent, name = match.groups()
+        depth = (len(indent) - 1) // 2
+        if name == parent and depth == 0:
+            result = {child: us for child, us, child_depth in pending if child_depth == 1}
+            break
+        if depth == 0:
+            pending = []
+        else:
+            pending.append((name, int(cumulative_us), depth))
+    return result
+
+
+def start_process(data_dir):
+    env = dict(
+        os.environ,
+        GITWATCH_DATA_DIR=data_dir,
+        GITWATCH_REPOS_PATH=os.path.join(data_dir, 'repos'),
+        GITWATCH_BCRYPT_ROUNDS='4',
+    )
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def run(args):
+    samples = {'cold.import': [], 'cold.bootstrap': [], 'warm.import': [], 'warm.bootstrap': []}
+    modules = {}
+    loaded = set()
+    for _ in range(args.repeat):
+        data_dir = tempfile.mkdtemp(prefix='gitwatch-bench-startup-')
+        for phase in ('cold', 'warm'):
+            result, stderr = start_process(data_dir)
+            samples[f'{phase}.import'].append(result['import_seconds'])
+            samples[f'{phase}.bootstrap'].append(result['bootstrap_seconds'])
+            loaded.update(result['loaded'])
+            for name, us in direct_imports_of(stderr, 'app').items():
+                modules.setdefault(name, []).append(us)
+
+    results = {name: {'median_ms': round(statistics.median(values) * 1000, 1),
+                      'max_ms': round(max(values) * 1000, 1)}
+               for name, values in samples.items()}
+    slowest = sorted(((statistics.median(us) / 1000, name) for name, us in modules.items()), reverse=True)
+    return {
+        'results': results,
+        'slowest_imports': {name: round(ms, 1) for ms, name in slowest[:args.top]},
+        'loaded_at_startup': sorted(loaded),
+    }
+
+
+def compare(report, previous):
+    print(f"{'phase':<18} {'before':>10} {'after':>10} {'change':>8}")
+    for name, result in report['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            print(f"{name:<18} {'-':>10} {result['median_ms']:>10} {'new':>8}")
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0
+        print(f"{name:<18} {before['median_ms']:>10} {result['median_ms']:>10} {change:>+7.1f}%")
+    newly_loaded = set(report['loaded_at_startup']) - set(previous.get('loaded_at_startup', []))
+    if newly_loaded:
+        print(f"Now imported at startup: {', '.join(sorted(newly_loaded))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="fresh data directories to start against")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON file from an earlier run to compare against")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    report['meta'] = {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+        return
+    for name, result in report['results'].items():
+        print(f"{name:<18} median {result['median_ms']:>8} ms   max {result['max_ms']:>8} ms")
+    print("Slowest imports of app (cumulative):")
+    for name, ms in report['slowest_imports'].items():
+        print(f"  {name:<32} {ms:>8} ms")
+    deferred = [name for name in DEFERRED_MODULES if name not in report['loaded_at_startup']]
+    print(f"Deferred until first use: {', '.join(deferred) or 'none'}")
+    if report['loaded_at_startup']:
+        print(f"Imported at startup: {', '.join(report['loaded_at_startup'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Times GitWatch's hot paths against synthetic repositories and a seeded database.
+
+Generates git repositories under a temporary GITWATCH_REPOS_PATH and a
+SQLite database with pull requests and comments, then times repository
+scanning, branch listing, diffs, merges and the dashboard and PR detail
+layouts. Cached paths are timed both cold (caches cleared before every
+call) and warm. Results are written as JSON so runs can be compared:
+
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --output after.json --compare before.json
+
+The same --seed and sizes always produce the same repositories.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GITWATCH_DATA_DIR', tempfile.mkdtemp(prefix='gitwatch-bench-suite-'))
+os.environ.setdefault('GITWATCH_REPOS_PATH', os.path.join(os.environ['GITWATCH_DATA_DIR'], 'repos'))
+os.environ.setdefault('GITWATCH_BCRYPT_ROUNDS', '4')
+os.environ.setdefault('GITWATCH_METRICS_SLOW_SECONDS', '0')
+
+import config
+import db
+import git_utils
+from diff_cache import diff_cache
+
+
+def git(repo_path, *args, input=None):
+    return subprocess.run(
+        ['git', '-C', repo_path, *args], check=True, capture_output=True, input=input,
+        env=dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@example.com',
+                 GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@example.com',
+                 GIT_AUTHOR_DATE='2024-01-01T00:00:00', GIT_COMMITTER_DATE='2024-01-01T00:00:00'),
+    ).stdout
+
+
+def text_file(rng, lines):
+    return ''.join(f"line {i} {rng.getrandbits(64):016x}\n" for i in range(lines))
+
+
+def _mkdir_file(repo_path, name):
+    full = os.path.join(repo_path, name)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    return full
+
+
+def make_repo(path, args, rng):
+    """Creates a repo with a main branch and args.branches feature branches.
+
+    Each feature branch rewrites args.diff_lines lines in args.changed_files
+    files and adds args.binary_files binary files.
+    """
+    os.makedirs(path)
+    git(path, 'init', '-q', '-b', 'main')
+    base = {}
+    for i in range(args.files):
+        name = f"src/module_{i // 100}/file_{i}.txt"
+        base[name] = text_file(rng, args.file_lines)
+        with open(_mkdir_file(path, name), 'w') as f:
+            f.write(base[name])
+    git(path, 'add', '-A')
+    git(path, 'commit', '-q', '-m', 'Initial commit')
+
+    names = sorted(base)
+    for b in range(args.branches):
+        git(path, 'checkout', '-q', '-b', f"feature-{b}", 'main')
+        for name in rng.sample(names, min(args.changed_files, len(names))):
+            lines = base[name].splitlines(keepends=True)
+            for line_no in rng.sample(range(len(lines)), min(args.diff_lines, len(lines))):
+                lines[line_no] = f"changed on feature-{b} {rng.getrandbits(64):016x}\n"
+            with open(os.path.join(path, name), 'w') as f:
+                f.writelines(lines)
+        for i in range(args.binary_files):
+            with open(_mkdir_file(path, f"assets/feature_{b}_{i}.bin"), 'wb') as f:
+                f.write(rng.randbytes(args.binary_bytes))
+        git(path, 'add', '-A')
+        git(path, 'commit', '-q', '-m', f"Work on feature-{b}")
+    git(path, 'checkout', '-q', 'main')
+
+
+def seed_db(repo_rows, args, rng):
+    """Adds users, args.prs pull requests and args.comments comments per PR."""
+    db.init_db()
+    with db.Session() as session:
+        users = [db.User(username=f"bench{i}", password_hash='x', is_admin=(i == 0)) for i in range(10)]
+        session.add_all(users)
+        session.commit()
+        repos = session.query(db.Repository).all()
+
+        started = datetime(2024, 1, 1)
+        prs = []
+        for i in range(args.prs):
+            repo = repos[i % len(repos)]
+            prs.append(db.PullRequest(
+                title=f"Benchmark PR {i}", description="Synthetic pull request",
+                author_id=users[i % len(users)].id, repo_id=repo.id,
+                source_branch=f"feature-{i % args.branches}", target_branch='main',
+                status=rng.choice(['open', 'open', 'closed', 'merged']),
+                created_at=started + timedelta(minutes=i),
+            ))
+        session.add_all(prs)
+        session.commit()
+
+        comments = []
+        for pr in prs:
+            for c in range(args.comments):
+                comments.append(db.Comment(
+                    pr_id=pr.id, user_id=users[c % len(users)].id, content=f"Comment {c} on #{pr.id}",
+                    created_at=pr.created_at + timedelta(seconds=c),
+                ))
+        session.add_all(comments)
+        session.commit()
+        open_pr = next(pr.id for pr in prs if pr.status == 'open')
+        return {'user_id': users[0].id, 'username': users[0].username, 'is_admin': True}, open_pr
+
+
+def timed(func, repeat, setup=None):
+    samples = []
+    for i in range(repeat):
+        if setup:
+            setup(i)
+        started = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        'runs': repeat,
+        'min_ms': round(samples[0] * 1000, 3),
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+    }
+
+
+def clear_caches(_=None):
+    diff_cache.clear()
+    git_utils.repo_pool.clear()
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    repo_paths = []
+    for r in range(args.repos):
+        path = os.path.join(config.REPOS_PATH, f"bench-repo-{r}")
+        make_repo(path, args, rng)
+        repo_paths.append(path)
+    repo = repo_paths[0]
+
+    repos, _ = git_utils.scan_repositories(force=True)
+    db.init_db()
+    db.sync_repositories(repos)
+    user_data, pr_id = seed_db(repos, args, rng)
+
+    # Imported late: app builds its layouts against the seeded database
+    import app
+
+    branch = lambda i: f"feature-{i % args.branches}"
+    results = {
+        'list_repositories.cold': timed(lambda i: git_utils.scan_repositories(force=True), args.repeat),
+        'list_repositories.warm': timed(lambda i: git_utils.list_repositories(), args.repeat),
+        'get_repo_branches.cold': timed(lambda i: git_utils.get_repo_branches(repo), args.repeat,
+                                        setup=lambda i: git_utils._branch_index.clear()),
+        'get_repo_branches.warm': timed(lambda i: git_utils.get_repo_branches(repo), args.repeat),
+        'get_diff.cold': timed(lambda i: git_utils.get_diff(repo, branch(i), 'main'), args.repeat, setup=clear_caches),
+        'get_diff.warm': timed(lambda i: git_utils.get_diff(repo, 'feature-0', 'main'), args.repeat),
+        'get_diff_summary.cold': timed(lambda i: git_utils.get_diff_summary(repo, branch(i), 'main'), args.repeat,
+                                       setup=clear_caches),
+        'get_dashboard_layout': timed(lambda i: app.get_dashboard_layout(user_data), args.repeat),
+        'get_pr_detail_layout.cold': timed(lambda i: app.get_pr_detail_layout(pr_id, user_data), args.repeat,
+                                           setup=clear_caches),
+        'get_pr_detail_layout.warm': timed(lambda i: app.get_pr_detail_layout(pr_id, user_data), args.repeat),
+    }
+
+    # Every merge gets its own target so each run does the same work
+    def merge_setup(i):
+        git(repo, 'branch', '-f', f"bench-target-{i}", 'main')
+
+    def merge(i):
+        success, msg = git_utils.merge_branch(repo, branch(i), f"bench-target-{i}")
+        if not success:
+            raise RuntimeError(msg)
+
+    results['merge_branch'] = timed(merge, args.repeat, setup=merge_setup)
+    return results
+
+
+def compare(results, previous):
+    print(f"{'benchmark':<28} {'before':>10} {'after':>10} {'change':>8}")
+    for name, result in results.items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            print(f"{name:<28} {'-':>10} {result['median_ms']:>10} {'new':>8}")
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0
+        print(f"{name:<28} {before['median_ms']:>10} {result['median_ms']:>10} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repos', type=int, default=3, help="number of repositories")
+    parser.add_argument('--branches', type=int, default=20, help="feature branches per repo")
+    parser.add_argument('--files', type=int, default=500, help="files on main")
+    parser.add_argument('--file-lines', type=int, default=200, help="lines per file")
+    parser.add_argument('--changed-files', type=int, default=50, help="files changed per branch")
+    parser.add_argument('--diff-lines', type=int, default=20, help="lines changed per changed file")
+    parser.add_argument('--binary-files', type=int, default=2, help="binary files added per branch")
+    parser.add_argument('--binary-bytes', type=int, default=64 * 1024)
+    parser.add_argument('--prs', type=int, default=500, help="pull requests in the database")
+    parser.add_argument('--comments', type=int, default=10, help="comments per pull request")
+    parser.add_argument('--repeat', type=int, default=10, help="timed runs per benchmark")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON file from an earlier run to compare against")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    started = time.time()
+    results = run(args)
+    report = {
+        'meta': {
+            'timestamp': datetime.utcfromtimestamp(started).isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'git': subprocess.run(['git', '--version'], capture_output=True, text=True).stdout.strip(),
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'json')},
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    elif args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    else:
+        for name, result in results.items():
+            print(f"{name:<28} median {result['median_ms']:>10} ms   p95 {result['p95_ms']:>10} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Load-tests the app under the Flask development server and under gunicorn.
+
+Each server is started as a subprocess on a fresh data directory. Client
+threads log in as the default admin and then repeatedly render the
+dashboard through the router callback, which is what every page view does:
+
+    python benchmarks/bench_wsgi.py --clients 16 --seconds 10 --workers 4 --threads 8
+
+gunicorn is skipped if it is not installed.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start in time")
+
+
+def start_server(mode, port, args):
+    data_dir = tempfile.mkdtemp(prefix=f'gitwatch-bench-wsgi-{mode}-')
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GITWATCH_DATA_DIR=data_dir,
+        GITWATCH_REPOS_PATH=os.path.join(data_dir, 'repos'),
+        GITWATCH_SESSION_BACKEND='sqlite',
+        GITWATCH_BCRYPT_ROUNDS='4',
+        GITWATCH_WORKERS=str(args.workers),
+        GITWATCH_THREADS=str(args.threads),
+    )
+    if mode == 'dev':
+        cmd = [sys.executable, 'app.py']
+    else:
+        cmd = [shutil.which('gunicorn'), '-c', 'gunicorn.conf.py', '--access-logfile', '', 'wsgi:application']
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, proc)
+    except Exception:
+        proc.kill()
+        raise
+    return proc
+
+
+def dash_request(conn, output, inputs, state=()):
+    payload = {
+        'output': output,
+        'outputs': [{'id': o.split('.')[0], 'property': o.split('.')[1]} for o in output.strip('.').split('...')],
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+        'changedPropIds': [f"{inputs[0][0]}.{inputs[0][1]}"],
+    }
+    if not output.startswith('..'):
+        payload['outputs'] = payload['outputs'][0]
+    conn.request('POST', '/_dash-update-component', body=json.dumps(payload),
+                 headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise RuntimeError(f"HTTP {response.status}")
+    return json.loads(body)
+
+
+def login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    result = dash_request(
+        conn, '..login-signal.data...login-alert.children..',
+        [('login-button', 'n_clicks', 1)],
+        [('login-username', 'value', 'admin'), ('login-password', 'value', 'admin')],
+    )
+    conn.close()
+    return result['response']['login-signal']['data']
+
+
+def run_load(port, clients, seconds):
+    token = login(port)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(clients)
+    deadline = [0.0]
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        start_barrier.wait()
+        while time.monotonic() < deadline[0]:
+            started = time.perf_counter()
+            try:
+                dash_request(conn, 'page-content.children',
+                             [('url', 'pathname', '/'), ('session-store', 'data', token)])
+                mine.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(str(e))
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    deadline[0] = time.monotonic() + seconds
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    modes = ['dev']
+    if shutil.which('gunicorn'):
+        modes.append('gunicorn')
+    else:
+        print("gunicorn not installed, only benchmarking the development server", file=sys.stderr)
+
+    results = {}
+    for mode in modes:
+        port = free_port()
+        proc = start_server(mode, port, args)
+        try:
+            results[mode] = run_load(port, args.clients, args.seconds)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(f"{name:>8}: {result['requests_per_second']:>8} req/s, p50 {result['p50_ms']}ms, "
+              f"p95 {result['p95_ms']}ms, {result['errors']} errors")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,20 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Text, Boolean
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Float, Index, and_, or_, func, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, joinedload
 from datetime import datetime
+import functools
+import json
+from collections import OrderedDict
 import os
-import bcrypt
+import re
+import threading
+import time
+
+import config
+import migrations
+from metrics import metrics
+from passwords import hash_password
 
 Base = declarative_base()
 
@@ -20,8 +32,8 @@ class Repository(Base):
     __tablename__ = 'repositories'
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
-    path = Column(String, nullable=False) # Local path
-    remote_path = Column(String, nullable=True) # Bare repo path
+    path = Column(String, nullable=False, index=True) # Local path
+    remote_path = Column(String, nullable=True) # Bare mirror that git reads use
     
     pull_requests = relationship("PullRequest", back_populates="repo")
 
@@ -31,15 +43,20 @@ class PullRequest(Base):
     title = Column(String, nullable=False)
     description = Column(Text)
     author_id = Column(Integer, ForeignKey('users.id'))
-    repo_id = Column(Integer, ForeignKey('repositories.id'))
+    repo_id = Column(Integer, ForeignKey('repositories.id'), index=True)
     source_branch = Column(String, nullable=False)
     target_branch = Column(String, default='main')
     status = Column(String, default='open') # open, merged, closed
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     author = relationship("User", back_populates="pull_requests")
     repo = relationship("Repository", back_populates="pull_requests")
     comments = relationship("Comment", back_populates="pr")
+    stats = relationship("PRStats", uselist=False, back_populates="pr")
+    mergeability = relationship("PRMergeability", uselist=False, back_populates="pr")
+
+    # Serves the status-filtered, newest-first dashboard lists
+    __table_args__ = (Index('ix_pull_requests_status_created_at', 'status', 'created_at', 'id'),)
 
 class Comment(Base):
     __tablename__ = 'comments'
@@ -52,13 +69,458 @@ class Comment(Base):
     pr = relationship("PullRequest", back_populates="comments")
     author = relationship("User", back_populates="comments")
 
+    __table_args__ = (
+        # Comment threads are read newest-first per PR, a page at a time
+        Index('ix_comments_pr_id_created_at', 'pr_id', 'created_at', 'id'),
+    )
+
+class PRStats(Base):
+    """Diff totals for a PR, computed when it is created and again by the
+    background job whenever either branch head moves away from the SHAs
+    stored here."""
+    __tablename__ = 'pr_stats'
+    pr_id = Column(Integer, ForeignKey('pull_requests.id'), primary_key=True)
+    source_sha = Column(String, nullable=False)
+    target_sha = Column(String, nullable=False)
+    files_changed = Column(Integer, nullable=False, default=0)
+    additions = Column(Integer, nullable=False, default=0)
+    deletions = Column(Integer, nullable=False, default=0)
+    computed_at = Column(DateTime, default=datetime.utcnow)
+
+    pr = relationship("PullRequest", back_populates="stats")
+
+class PRMergeability(Base):
+    """Result of the background merge check for the SHA pair stored here."""
+    __tablename__ = 'pr_mergeability'
+    pr_id = Column(Integer, ForeignKey('pull_requests.id'), primary_key=True)
+    source_sha = Column(String, nullable=False)
+    target_sha = Column(String, nullable=False)
+    state = Column(String, nullable=False) # clean, conflicts, merged, unknown
+    conflicts = Column(Text) # JSON list of conflicting paths
+    checked_at = Column(DateTime, default=datetime.utcnow)
+
+    pr = relationship("PullRequest", back_populates="mergeability")
+
+    @property
+    def conflict_paths(self):
+        return json.loads(self.conflicts) if self.conflicts else []
+
+class Event(Base):
+    """Change feed for live updates. The id doubles as a version number:
+    clients remember the last id they applied and ask for newer ones."""
+    __tablename__ = 'events'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False) # pr_created, pr_status, comment
+    pr_id = Column(Integer, ForeignKey('pull_requests.id'), nullable=False)
+    comment_id = Column(Integer, ForeignKey('comments.id'), nullable=True)
+    status = Column(String, nullable=True) # new PR status for pr_status events
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_events_pr_id_id', 'pr_id', 'id'),)
+
+class UserSession(Base):
+    """Server-side session, used when GITWATCH_SESSION_BACKEND=database."""
+    __tablename__ = 'sessions'
+    token = Column(String, primary_key=True)
+    data = Column(Text, nullable=False) # JSON
+    expires_at = Column(Float, nullable=False, index=True)
+
 # Database setup
-DB_PATH = 'sqlite:///gitwatch.db'
-engine = create_engine(DB_PATH)
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run alongside a writer; NORMAL sync is safe with WAL
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={config.DB_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={config.DB_MMAP_SIZE}")
+    cursor.close()
+
+def create_db_engine(url=None, tune_sqlite=True):
+    """Creates the engine for the configured database (config.DB_PATH, set
+    with GITWATCH_DATABASE_URL), e.g. a local SQLite file or PostgreSQL.
+
+    SQLite connections are switched to WAL mode with a busy timeout so
+    concurrent callbacks wait for the write lock instead of failing with
+    "database is locked". The pool is sized for the server's concurrency.
+    """
+    url = make_url(url or config.DB_PATH)
+    kwargs = {}
+    if url.get_backend_name() == 'sqlite':
+        kwargs['connect_args'] = {'check_same_thread': False, 'timeout': config.DB_BUSY_TIMEOUT_MS / 1000}
+        if url.database and url.database != ':memory:':
+            kwargs.update(pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW)
+    else:
+        # Server databases drop idle connections; check them before use
+        kwargs.update(
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=config.DB_POOL_RECYCLE,
+        )
+    new_engine = create_engine(url, **kwargs)
+    if url.get_backend_name() == 'sqlite' and tune_sqlite:
+        event.listen(new_engine, 'connect', _set_sqlite_pragmas)
+    return new_engine
+
+_STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+"?(\w+)', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=1024)
+def _statement_name(statement):
+    """Names a statement by its verb and first table, e.g. 'select
+    pull_requests', to keep the number of metric series small."""
+    words = statement.split(None, 1)
+    if not words:
+        return 'unknown'
+    match = _STATEMENT_TABLE.search(statement)
+    return f"{words[0].lower()} {match.group(1)}" if match else words[0].lower()
+
+def instrument_engine(db_engine):
+    """Records the latency and errors of every statement run on db_engine
+    as kind 'db', and logs the slow ones."""
+    @event.listens_for(db_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(db_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        name = _statement_name(statement)
+        metrics.observe_call('db', name, elapsed)
+        if metrics.slow_seconds and elapsed >= metrics.slow_seconds:
+            print(f"Slow db {name}: {elapsed:.3f}s")
+
+    @event.listens_for(db_engine, 'handle_error')
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
+        metrics.observe_error('db', _statement_name(context.statement) if context.statement else 'connect')
+
+DB_PATH = config.DB_PATH
+engine = create_db_engine()
+if config.METRICS_ENABLED:
+    instrument_engine(engine)
 Session = sessionmaker(bind=engine)
+if hasattr(os, 'register_at_fork'):
+    # Pooled connections inherited from a preloading parent belong to it
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
 
 def init_db():
-    Base.metadata.create_all(engine)
+    """Brings the schema up to date by applying pending migrations."""
+    migrations.upgrade(engine)
+
+def get_bootstrap_key():
+    """Identifies the database and schema version startup work was done
+    for: a different database, a recreated SQLite file or a new migration
+    all give a different key. None if the SQLite file doesn't exist yet."""
+    key = {
+        'database': engine.url.render_as_string(hide_password=True),
+        'schema_version': migrations.MIGRATIONS[-1][0],
+    }
+    if engine.url.get_backend_name() == 'sqlite':
+        try:
+            key['inode'] = os.stat(engine.url.database).st_ino
+        except (OSError, TypeError):
+            return None
+    return key
+
+# LRU cache of user rows for session resolution and permission checks
+_user_cache = OrderedDict()  # user_id -> (user info dict, cached_at)
+_user_cache_lock = threading.Lock()
+
+def get_user_info(user_id):
+    """Returns {'user_id', 'username', 'is_admin'} for user_id, or None if the
+    user does not exist. Served from an LRU cache; entries are refetched after
+    USER_CACHE_TTL seconds so changes made by other processes show up."""
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry and now - entry[1] < config.USER_CACHE_TTL:
+            _user_cache.move_to_end(user_id)
+            return entry[0]
+
+    with Session() as session:
+        user = session.get(User, user_id)
+        info = {'user_id': user.id, 'username': user.username, 'is_admin': bool(user.is_admin)} if user else None
+
+    if info:
+        with _user_cache_lock:
+            _user_cache[user_id] = (info, now)
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > config.USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
+    return info
+
+def invalidate_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+def sync_repositories(repos):
+    """Brings the repositories table in line with a filesystem scan.
+
+    repos is a list of {'name', 'path'} dicts. New repos are inserted and
+    moved ones get their path updated. Rows for repos that disappeared are
+    deleted unless pull requests still reference them.
+    """
+    found = {r['name']: r['path'] for r in repos}
+    with Session() as session:
+        for repo in session.query(Repository).all():
+            path = found.pop(repo.name, None)
+            if path is None:
+                if not session.query(PullRequest.id).filter_by(repo_id=repo.id).first():
+                    session.delete(repo)
+            elif repo.path != path:
+                repo.path = path
+                # The mirror fetches from the old path; a new one is made
+                repo.remote_path = None
+        for name, path in found.items():
+            session.add(Repository(name=name, path=path))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another process synced the same scan first
+            session.rollback()
+
+def get_repository_options(session):
+    """Returns (name, path) rows for the repository select, sorted by name."""
+    return session.query(Repository.name, Repository.path).order_by(Repository.name).all()
+
+def _parse_keyset_cursor(cursor):
+    """Returns (created_at, id) from a get_pr_page or get_comment_page
+    cursor, or None if it is malformed. Cursors round-trip through the
+    browser."""
+    if not isinstance(cursor, dict) or type(cursor.get('id')) is not int:
+        return None
+    try:
+        return datetime.fromisoformat(cursor['created_at']), cursor['id']
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def get_pr_page(session, status, cursor=None, limit=25):
+    """Returns one page of pull requests with the given status, newest first,
+    along with the cursor for the next page (None on the last page).
+
+    Uses keyset pagination on (created_at, id) so the cost of a page does not
+    depend on how far into the history it is. Author, repo, diff stats and
+    mergeability are loaded in the same query. A malformed cursor gives an
+    empty page and no next cursor.
+    """
+    query = (
+        session.query(PullRequest)
+        .options(joinedload(PullRequest.author), joinedload(PullRequest.repo), joinedload(PullRequest.stats),
+                 joinedload(PullRequest.mergeability))
+        .filter(PullRequest.status == status)
+    )
+    if cursor:
+        parsed = _parse_keyset_cursor(cursor)
+        if parsed is None:
+            return [], None
+        created_at, last_id = parsed
+        query = query.filter(or_(
+            PullRequest.created_at < created_at,
+            and_(PullRequest.created_at == created_at, PullRequest.id < last_id)
+        ))
+    prs = query.order_by(PullRequest.created_at.desc(), PullRequest.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(prs) > limit:
+        prs = prs[:limit]
+        next_cursor = {'created_at': prs[-1].created_at.isoformat(), 'id': prs[-1].id}
+    return prs, next_cursor
+
+def get_comment_page(session, pr_id, cursor=None, limit=50):
+    """Returns the newest page of comments on a PR that are older than cursor,
+    oldest first, along with the cursor for the page before it (None if
+    there are no older comments). Authors are loaded in the same query. A
+    malformed cursor gives no comments and no cursor.
+    """
+    query = (
+        session.query(Comment)
+        .options(joinedload(Comment.author))
+        .filter(Comment.pr_id == pr_id)
+    )
+    if cursor:
+        parsed = _parse_keyset_cursor(cursor)
+        if parsed is None:
+            return [], None
+        created_at, last_id = parsed
+        query = query.filter(or_(
+            Comment.created_at < created_at,
+            and_(Comment.created_at == created_at, Comment.id < last_id)
+        ))
+    comments = query.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = {'created_at': comments[-1].created_at.isoformat(), 'id': comments[-1].id}
+    comments.reverse()
+    return comments, next_cursor
+
+def save_pr_stats(session, pr_id, stats):
+    """Inserts or updates the pr_stats row from a git_utils.get_diff_stats
+    result. The caller commits."""
+    row = session.get(PRStats, pr_id)
+    if row is None:
+        row = PRStats(pr_id=pr_id)
+        session.add(row)
+    for field in ('source_sha', 'target_sha', 'files_changed', 'additions', 'deletions'):
+        setattr(row, field, stats[field])
+    row.computed_at = datetime.utcnow()
+    return row
+
+def save_pr_mergeability(session, pr_id, result):
+    """Inserts or updates the pr_mergeability row from a
+    git_utils.check_mergeability result. The caller commits."""
+    row = session.get(PRMergeability, pr_id)
+    if row is None:
+        row = PRMergeability(pr_id=pr_id)
+        session.add(row)
+    row.source_sha = result['source_sha']
+    row.target_sha = result['target_sha']
+    row.state = result['state']
+    row.conflicts = json.dumps(result['conflicts'])
+    row.checked_at = datetime.utcnow()
+    return row
+
+def record_event(session, kind, pr_id, comment_id=None, status=None):
+    """Adds a change feed event to the session; it is written by the
+    caller's commit, together with the change it describes."""
+    session.add(Event(kind=kind, pr_id=pr_id, comment_id=comment_id, status=status))
+
+def get_latest_event_id(session, pr_id=None):
+    """Returns the newest event id (0 if there are none), optionally only
+    counting events for one PR."""
+    query = session.query(func.max(Event.id))
+    if pr_id is not None:
+        query = query.filter(Event.pr_id == pr_id)
+    return query.scalar() or 0
+
+def get_events(session, after_id, up_to_id, pr_id=None, limit=500):
+    """Returns events with after_id < id <= up_to_id, oldest first."""
+    query = session.query(Event).filter(Event.id > after_id, Event.id <= up_to_id)
+    if pr_id is not None:
+        query = query.filter(Event.pr_id == pr_id)
+    return query.order_by(Event.id).limit(limit).all()
+
+# Markers around matched terms in search snippets
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+_search_index_available = {}  # engine url -> bool
+
+def _has_search_index(session):
+    bind = session.get_bind()
+    key = str(bind.url)
+    if key not in _search_index_available:
+        _search_index_available[key] = bind.dialect.name == 'sqlite' and inspect(bind).has_table('pr_search')
+    return _search_index_available[key]
+
+def _fts_query(query):
+    """Turns free text into an FTS5 query: every word must match, and the
+    last one may be a prefix so results show up while typing."""
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+def search_prs(session, query, offset=0, limit=20):
+    """Searches PR titles, descriptions and comments. Returns (results,
+    has_more, truncated); each result is {'pr': PullRequest, 'snippet': str}
+    with matches wrapped in SNIPPET_START/SNIPPET_END.
+
+    On SQLite with the FTS5 index from migration 6 every matching PR and
+    comment is ranked by bm25, titles weighted above descriptions. Scoring
+    costs a few microseconds per match, so a word so common that more than
+    config.SEARCH_MAX_HITS PRs or comments match only has its newest
+    matches ranked, and truncated is True. Elsewhere a LIKE scan returns
+    the newest matching PRs first and truncated is always False.
+    """
+    if not query or not query.strip():
+        return [], False, False
+    truncated = False
+    if _has_search_index(session):
+        hits, truncated = _search_fts(session, query, offset, limit + 1)
+    else:
+        hits = _search_like(session, query, offset, limit + 1)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    prs = (
+        session.query(PullRequest)
+        .options(joinedload(PullRequest.author), joinedload(PullRequest.repo), joinedload(PullRequest.stats),
+                 joinedload(PullRequest.mergeability))
+        .filter(PullRequest.id.in_([pr_id for pr_id, _ in hits]))
+        .all()
+    )
+    by_id = {pr.id: pr for pr in prs}
+    return [{'pr': by_id[pr_id], 'snippet': snippet} for pr_id, snippet in hits if pr_id in by_id], has_more, truncated
+
+def _search_fts(session, query, offset, limit):
+    match = _fts_query(query)
+    if match is None:
+        return [], False
+    # At most the newest max_hits matches of each kind are scored: walking
+    # the index in rowid order stops early, while ranking every match of a
+    # common word would touch a large part of the index. MIN() makes SQLite return
+    # the other columns from the best-scoring row, so every PR comes back
+    # with the document that matched it best.
+    rows = session.execute(text("""
+        SELECT pr_id, source, doc_id, MIN(score) AS score FROM (
+            SELECT * FROM (
+                SELECT rowid AS pr_id, 'pr' AS source, rowid AS doc_id, rank AS score
+                FROM pr_search WHERE pr_search MATCH :match AND rank MATCH 'bm25(5.0, 1.0)'
+                ORDER BY rowid DESC LIMIT :max_hits
+            )
+            UNION ALL
+            SELECT comments.pr_id, 'comment', hits.doc_id, hits.score FROM (
+                SELECT rowid AS doc_id, rank AS score
+                FROM comment_search WHERE comment_search MATCH :match
+                ORDER BY rowid DESC LIMIT :max_hits
+            ) AS hits JOIN comments ON comments.id = hits.doc_id
+        )
+        GROUP BY pr_id ORDER BY score, pr_id DESC LIMIT :limit OFFSET :offset
+    """), {'match': match, 'max_hits': config.SEARCH_MAX_HITS, 'limit': limit, 'offset': offset}).all()
+    # Counting past max_hits doesn't score anything, so this is cheap
+    truncated = bool(session.execute(text("""
+        SELECT EXISTS (SELECT 1 FROM pr_search WHERE pr_search MATCH :match LIMIT 1 OFFSET :max_hits)
+            OR EXISTS (SELECT 1 FROM comment_search WHERE comment_search MATCH :match LIMIT 1 OFFSET :max_hits)
+    """), {'match': match, 'max_hits': config.SEARCH_MAX_HITS}).scalar())
+
+    # One snippet query per index for the whole page
+    snippets = {}
+    for source, table, column in (('pr', 'pr_search', -1), ('comment', 'comment_search', 0)):
+        doc_ids = [doc_id for _, row_source, doc_id, _ in rows if row_source == source]
+        if not doc_ids:
+            continue
+        placeholders = ', '.join(f":doc{i}" for i in range(len(doc_ids)))
+        params = {f"doc{i}": doc_id for i, doc_id in enumerate(doc_ids)}
+        params.update({'start': SNIPPET_START, 'end': SNIPPET_END, 'match': match})
+        for doc_id, snippet in session.execute(text(
+            f"SELECT rowid, snippet({table}, {column}, :start, :end, '…', 24) FROM {table} "
+            f"WHERE {table} MATCH :match AND rowid IN ({placeholders})"
+        ), params):
+            snippets[(source, doc_id)] = snippet
+    return [(pr_id, snippets.get((source, doc_id)) or '') for pr_id, source, doc_id, _ in rows], truncated
+
+def _search_like(session, query, offset, limit):
+    escaped = query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f"%{escaped}%"
+    commented = session.query(Comment.pr_id).filter(Comment.content.ilike(pattern, escape='\\'))
+    rows = (
+        session.query(PullRequest.id, PullRequest.description)
+        .filter(or_(
+            PullRequest.title.ilike(pattern, escape='\\'),
+            PullRequest.description.ilike(pattern, escape='\\'),
+            PullRequest.id.in_(commented)
+        ))
+        .order_by(PullRequest.created_at.desc(), PullRequest.id.desc())
+        .offset(offset).limit(limit)
+        .all()
+    )
+    return [(pr_id, (description or '')[:200]) for pr_id, description in rows]
+
+def count_prs(session, status):
+    return session.query(func.count(PullRequest.id)).filter(PullRequest.status == status).scalar()
 
 def create_user(username, password, is_admin=False):
     """Creates a new user with hashed password. Returns the user object or None if username exists."""
@@ -66,7 +528,8 @@ def create_user(username, password, is_admin=False):
         if session.query(User).filter_by(username=username).first():
             return None
         
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        # Runs on the password worker pool; may raise PasswordQueueFull
+        hashed = hash_password(password)
         new_user = User(username=username, password_hash=hashed, is_admin=is_admin)
         session.add(new_user)
         session.commit()
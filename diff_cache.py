@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import config
+
+
+class DiffCache:
+    """Size-bounded LRU cache for diff results.
+
+    Keys are tuples of strings that include the resolved commit SHAs, e.g.
+    (repo_path, target_sha, source_sha). A SHA pair always produces the same
+    diff, so entries are never invalidated - only evicted when the cache
+    grows past its byte budget. Values must be JSON serialisable so they can
+    be spilled to the optional on-disk tier.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._disk_bytes = None  # computed lazily on first disk write
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_file(self, key):
+        digest = hashlib.sha1('\0'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.json")
+
+    def get(self, key):
+        """Returns the cached value for key or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.disk_dir:
+            path = self._disk_file(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = f.read()
+                value = json.loads(data)
+                os.utime(path)  # Disk tier evicts by mtime
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, value, len(data))
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        with self._lock:
+            self._store(key, value, len(data))
+        if self.disk_dir:
+            self._write_disk(key, data)
+
+    def _store(self, key, value, size):
+        # Caller holds the lock
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _write_disk(self, key, data):
+        path = self._disk_file(key)
+        # A unique temp file per write: threads in different worker
+        # processes can have the same thread id
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing diff cache entry: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(e.stat().st_size for e in os.scandir(self.disk_dir) if e.name.endswith('.json'))
+            else:
+                self._disk_bytes += len(data)
+            if self._disk_bytes <= self.disk_max_bytes:
+                return
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Caller holds the lock. Drop least recently used files until the
+        # tier is back under 90% of its budget.
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.json'):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_enabled': bool(self.disk_dir),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+diff_cache = DiffCache(
+    config.DIFF_CACHE_MAX_BYTES,
+    disk_dir=config.DIFF_CACHE_DIR if config.DIFF_CACHE_DISK else None,
+    disk_max_bytes=config.DIFF_CACHE_DISK_MAX_BYTES,
+)
@@ -1,7 +1,25 @@
+import hashlib
 import os
-import git
-from git import Repo
+import re
 import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks
+    fcntl = None
+
+import config
+from diff_cache import diff_cache
+from mirrors import mirrors
+from metrics import metrics, instrument
+from repo_pool import repo_pool
 
 def get_local_projects_path():
     """Get repository scan path from environment variable or default."""
@@ -14,91 +32,711 @@ def get_project_repos_path():
         return repos_path
     return None
 
+# Cached result of the last repository scan, refreshed by scan_repositories
+_repo_scan = {'base_path': None, 'mtime': None, 'scanned_at': 0.0, 'repos': {}, 'generation': 0}
+_repo_scan_lock = threading.Lock()
+
+def _is_repo_dir(full_path):
+    return os.path.isdir(full_path) and os.path.exists(os.path.join(full_path, '.git'))
+
+@instrument('git')
+def scan_repositories(force=False):
+    """Returns (repos, generation) where repos is a list of repo names and
+    paths and generation is a counter that increases whenever the set of
+    repos changes.
+
+    The scan is cached. While the mtime of the repos directory is unchanged
+    only that one stat is done. When it changes (an entry was added or
+    removed) the directory is listed again and only new entries are
+    checked. Every REPO_SCAN_TTL seconds, or with force=True, all entries
+    are checked again to pick up directories that became repos in place.
+    """
+    base_path = get_local_projects_path()
+    with _repo_scan_lock:
+        try:
+            mtime = os.stat(base_path).st_mtime
+        except OSError:
+            if _repo_scan['repos']:
+                _repo_scan['generation'] += 1
+            _repo_scan.update(base_path=base_path, mtime=None, scanned_at=0.0, repos={})
+            return [], _repo_scan['generation']
+
+        now = time.monotonic()
+        full_rescan = (
+            force
+            or _repo_scan['base_path'] != base_path
+            or now - _repo_scan['scanned_at'] > config.REPO_SCAN_TTL
+        )
+        if not full_rescan and mtime == _repo_scan['mtime']:
+            return _repo_list(), _repo_scan['generation']
+
+        known = {} if full_rescan else _repo_scan['repos']
+        repos = {}
+        for name in os.listdir(base_path):
+            full_path = os.path.join(base_path, name)
+            if name in known or _is_repo_dir(full_path):
+                repos[name] = full_path
+
+        if repos != _repo_scan['repos']:
+            _repo_scan['generation'] += 1
+        _repo_scan.update(base_path=base_path, mtime=mtime, repos=repos)
+        if full_rescan:
+            _repo_scan['scanned_at'] = now
+        return _repo_list(), _repo_scan['generation']
+
+def _repo_list():
+    # Caller holds _repo_scan_lock
+    return [{'name': name, 'path': path} for name, path in sorted(_repo_scan['repos'].items())]
+
 def list_repositories():
     """Scans local projects and returns a list of repo names and paths."""
-    base_path = get_local_projects_path()
-    repos = []
-    if not os.path.exists(base_path):
-        return repos
-        
-    for name in os.listdir(base_path):
-        full_path = os.path.join(base_path, name)
-        if os.path.isdir(full_path) and os.path.exists(os.path.join(full_path, '.git')):
-            repos.append({'name': name, 'path': full_path})
+    repos, _ = scan_repositories()
     return repos
 
+# Per-repo branch lists, rebuilt only when the refs on disk change
+_branch_index = {}  # abs repo path -> {'git_dir', 'signature', 'branches'}
+_branch_index_lock = threading.Lock()
+
+def _refs_signature(git_dir):
+    """Returns a value that changes whenever a local branch is created,
+    moved or deleted: the mtimes of packed-refs and of every directory
+    under refs/heads (loose ref updates rename a file into its directory)."""
+    try:
+        packed = os.stat(os.path.join(git_dir, 'packed-refs')).st_mtime_ns
+    except OSError:
+        packed = None
+
+    dir_mtimes = []
+    stack = [os.path.join(git_dir, 'refs', 'heads')]
+    while stack:
+        path = stack.pop()
+        try:
+            dir_mtimes.append(os.stat(path).st_mtime_ns)
+            stack.extend(entry.path for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False))
+        except OSError:
+            pass
+    return packed, len(dir_mtimes), max(dir_mtimes, default=None)
+
+@instrument('git')
 def get_repo_branches(repo_path):
+    """Returns local branch names, most recently committed first."""
+    read_path = mirrors.read_path(repo_path)
+    key = os.path.abspath(read_path)
     try:
-        repo = Repo(repo_path)
-        return [head.name for head in repo.heads]
+        with _branch_index_lock:
+            entry = _branch_index.get(key)
+        if entry and _refs_signature(entry['git_dir']) == entry['signature']:
+            return entry['branches']
+
+        with repo_pool.acquire(read_path) as repo:
+            git_dir = repo.common_dir
+            # Take the signature before reading so a concurrent ref update
+            # invalidates the entry instead of being lost
+            signature = _refs_signature(git_dir)
+            output = repo.git.for_each_ref('--sort=-committerdate', '--format=%(refname:lstrip=2)', 'refs/heads')
+        branches = [line for line in output.split('\n') if line]
+
+        with _branch_index_lock:
+            _branch_index[key] = {'git_dir': git_dir, 'signature': signature, 'branches': branches}
+        return branches
     except Exception as e:
+        metrics.observe_error('git', 'get_repo_branches')
         print(f"Error getting branches for {repo_path}: {e}")
         return []
 
+@instrument('git')
+def search_branches(repo_path, prefix='', limit=50):
+    """Returns (branches, total) where branches holds up to limit branch
+    names starting with prefix (case-insensitive), most recent first, and
+    total is the number of matches."""
+    prefix = (prefix or '').lower()
+    matches = [b for b in get_repo_branches(repo_path) if b.lower().startswith(prefix)]
+    return matches[:limit], len(matches)
+
+@instrument('git')
 def create_branch(repo_path, branch_name, source_branch='main'):
     try:
-        repo = Repo(repo_path)
-        if branch_name in repo.heads:
-            return False, "Branch already exists"
+        with repo_pool.acquire(repo_path) as repo:
+            if branch_name in repo.heads:
+                return False, "Branch already exists"
         
-        if source_branch not in repo.heads:
-             return False, f"Source branch {source_branch} does not exist"
+            if source_branch not in repo.heads:
+                 return False, f"Source branch {source_branch} does not exist"
 
-        source = repo.heads[source_branch]
-        new_branch = repo.create_head(branch_name, source)
-        # Don't checkout, just create
+            source = repo.heads[source_branch]
+            new_branch = repo.create_head(branch_name, source)
+            # Don't checkout, just create
+        mirrors.fetch_now(repo_path)
         return True, f"Branch {branch_name} created"
     except Exception as e:
+        metrics.observe_error('git', 'create_branch')
         return False, str(e)
 
+def _resolve_branch_pair(repo, source_branch, target_branch):
+    """Returns (target_sha, source_sha) or None if either branch is missing."""
+    if source_branch not in repo.heads or target_branch not in repo.heads:
+        return None
+    return repo.heads[target_branch].commit.hexsha, repo.heads[source_branch].commit.hexsha
+
+def _resolve_diff_pair(repo_path, source_branch, target_branch):
+    with repo_pool.acquire(mirrors.read_path(repo_path)) as repo:
+        return _resolve_branch_pair(repo, source_branch, target_branch)
+
+def _merge_base(repo_path, target_sha, source_sha):
+    """Returns the commit where source_sha forked off target_sha, or
+    target_sha if the histories are unrelated. Cached per SHA pair."""
+    cache_key = (os.path.abspath(repo_path), target_sha, source_sha, 'merge-base')
+    base = diff_cache.get(cache_key)
+    if base is None:
+        from git import GitCommandError
+        with repo_pool.acquire(mirrors.read_path(repo_path)) as repo:
+            try:
+                base = repo.git.merge_base(target_sha, source_sha)
+            except GitCommandError as e:
+                # Status 1 means no common ancestor; anything else is an
+                # error and must not be cached
+                if e.status != 1:
+                    raise
+                base = target_sha
+        diff_cache.put(cache_key, base)
+    return base
+
+def _resolve_diff_range(repo_path, source_branch, target_branch):
+    """Returns (base_sha, source_sha) for a three-dot diff, like GitHub's:
+    only the changes made on source_branch since it forked off
+    target_branch, however far target_branch has moved on since. None if
+    either branch is missing."""
+    pair = _resolve_diff_pair(repo_path, source_branch, target_branch)
+    if not pair:
+        return None
+    target_sha, source_sha = pair
+    return _merge_base(repo_path, target_sha, source_sha), source_sha
+
+class _StreamReader:
+    """Wraps a git stdout pipe and remembers whether it was read to the end."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.eof = False
+
+    def read1(self, size):
+        chunk = self._stream.read1(size)
+        if not chunk:
+            self.eof = True
+        return chunk
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self._stream.readline()
+        if not line:
+            self.eof = True
+            raise StopIteration
+        return line
+
+@contextmanager
+def _git_stream(repo_path, *args):
+    """Runs git with stdout piped so output can be consumed incrementally.
+    The process is killed if the caller stops reading early. If the caller
+    read everything and git failed, RuntimeError is raised with git's
+    error message, so a failure is never mistaken for empty output."""
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(['git', '-C', repo_path, *args], stdout=subprocess.PIPE, stderr=stderr)
+        reader = _StreamReader(proc.stdout)
+        try:
+            yield reader
+        finally:
+            if not reader.eof and proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            returncode = proc.wait()
+        if reader.eof and returncode != 0:
+            stderr.seek(0)
+            message = stderr.read(4096).decode('utf-8', errors='replace').strip()
+            raise RuntimeError(message or f"git {args[0]} exited with {returncode}")
+
+def _iter_nul_tokens(stream, chunk_size=64 * 1024):
+    """Yields the NUL separated tokens of a -z output stream as text."""
+    pending = b''
+    while True:
+        chunk = stream.read1(chunk_size)
+        if not chunk:
+            break
+        parts = (pending + chunk).split(b'\0')
+        pending = parts.pop()
+        for part in parts:
+            yield part.decode('utf-8', errors='replace')
+    if pending:
+        yield pending.decode('utf-8', errors='replace')
+
+def _iter_raw_numstat(tokens):
+    """Parses `git diff --raw --numstat -z` tokens into summary dicts.
+
+    The raw records come first and carry the change type, the numstat
+    records follow in the same order and carry the line counts, so a file
+    is yielded as soon as its numstat record arrives.
+    """
+    tokens = iter(tokens)
+    pending = deque()
+    for token in tokens:
+        if not token:
+            continue
+        if token.startswith(':'):
+            status = token[1:].split(' ')[4]
+            change_type = status[0]
+            if change_type in ('R', 'C'):
+                old_path, path = next(tokens), next(tokens)
+            else:
+                old_path = path = next(tokens)
+            pending.append({
+                'path': path,
+                'old_path': old_path,
+                'change_type': change_type,
+                'additions': 0,
+                'deletions': 0,
+                'binary': False
+            })
+            continue
+
+        added, deleted, path = token.split('\t', 2)
+        if not path:
+            # Renames and copies have an empty path followed by old and new paths
+            next(tokens)
+            next(tokens)
+        entry = pending.popleft()
+        if added == '-':
+            entry['binary'] = True
+        else:
+            entry['additions'] = int(added)
+            entry['deletions'] = int(deleted)
+        yield entry
+
+@instrument('git')
+def iter_diff_summary(repo_path, source_branch, target_branch='main'):
+    """Yields per-file change stats one file at a time, without building any
+    patch text. Each dict contains: path, old_path, change_type, additions,
+    deletions, binary. Yields nothing if there are no changes or on error.
+    Like every diff here, it covers the changes made on source_branch since
+    its merge base with target_branch.
+
+    The full list is cached by SHA pair once it has been read to the end;
+    stopping early does not populate the cache.
+    """
+    try:
+        diff_range = _resolve_diff_range(repo_path, source_branch, target_branch)
+        if not diff_range:
+            return
+        yield from _iter_summary_for_pair(repo_path, *diff_range)
+    except Exception as e:
+        metrics.observe_error('git', 'iter_diff_summary')
+        print(f"Error generating diff summary: {e}")
+
+def _iter_summary_for_pair(repo_path, base_sha, source_sha):
+    # Keyed by the merge base, so the entry survives commits to the target
+    # branch that don't touch the fork point
+    cache_key = (os.path.abspath(repo_path), base_sha, source_sha, 'summary')
+    cached = diff_cache.get(cache_key)
+    if cached is not None:
+        yield from cached
+        return
+
+    files = []
+    with _git_stream(mirrors.read_path(repo_path), 'diff', '--raw', '--numstat', '-z', '-M', '--no-color', base_sha, source_sha) as stream:
+        for entry in _iter_raw_numstat(_iter_nul_tokens(stream)):
+            files.append(entry)
+            yield entry
+
+    diff_cache.put(cache_key, files)
+
+def get_diff_summary(repo_path, source_branch, target_branch='main'):
+    """Returns the complete iter_diff_summary list."""
+    return list(iter_diff_summary(repo_path, source_branch, target_branch))
+
+def get_branch_heads(repo_path, source_branch, target_branch):
+    """Returns (source_sha, target_sha), or None if either branch is missing."""
+    try:
+        pair = _resolve_diff_pair(repo_path, source_branch, target_branch)
+    except Exception as e:
+        metrics.observe_error('git', 'get_branch_heads')
+        print(f"Error resolving branches in {repo_path}: {e}")
+        return None
+    if not pair:
+        return None
+    return pair[1], pair[0]
+
+@instrument('git')
+def get_diff_stats(repo_path, source_branch, target_branch='main'):
+    """Returns the totals shown on the dashboard for a branch pair:
+    source_sha, target_sha, files_changed, additions, deletions. Binary
+    files count as changed files without lines. Returns None if either
+    branch is missing or on error.
+    """
+    try:
+        pair = _resolve_diff_pair(repo_path, source_branch, target_branch)
+        if not pair:
+            return None
+        target_sha, source_sha = pair
+        base_sha = _merge_base(repo_path, target_sha, source_sha)
+        files = list(_iter_summary_for_pair(repo_path, base_sha, source_sha))
+    except Exception as e:
+        metrics.observe_error('git', 'get_diff_stats')
+        print(f"Error computing diff stats: {e}")
+        return None
+    return {
+        'source_sha': source_sha,
+        'target_sha': target_sha,
+        'files_changed': len(files),
+        'additions': sum(f['additions'] for f in files),
+        'deletions': sum(f['deletions'] for f in files),
+    }
+
+def _iter_patch_chunks(stream, max_hunk_bytes=None):
+    """Splits a `git diff` patch stream into per-file (header, hunks) lists
+    of raw byte lines, in the order git emits them. Once a file's hunks
+    pass max_hunk_bytes the rest of its lines are skipped, so an oversized
+    file costs no more memory than the limit; its hunks then add up to more
+    than max_hunk_bytes, which _build_patch reports as too large."""
+    header, hunks, hunk_bytes = None, None, 0
+    for line in stream:
+        if line.startswith(b'diff --git '):
+            if header is not None:
+                yield header, hunks
+            header, hunks, hunk_bytes = [line], [], 0
+        elif hunks or line.startswith(b'@@'):
+            if max_hunk_bytes is None or hunk_bytes <= max_hunk_bytes:
+                hunks.append(line)
+                hunk_bytes += len(line)
+        elif header is not None:
+            header.append(line)
+    if header is not None:
+        yield header, hunks
+
+def _build_patch(header, hunks, max_file_bytes):
+    """Returns (patch_text, summarized) for one file's patch lines.
+    Binary and oversized files are never decoded."""
+    if any(line.startswith((b'Binary files ', b'GIT binary patch')) for line in header):
+        return None, 'binary'
+    # Patches without hunks (pure renames, mode changes) show their header
+    lines = hunks or header
+    size = sum(len(line) for line in lines)
+    if size > max_file_bytes:
+        return None, 'too_large'
+    return b''.join(lines).decode('utf-8', errors='replace').rstrip('\n'), None
+
+@instrument('git')
+def iter_diff(repo_path, source_branch, target_branch='main', max_file_bytes=None, max_total_bytes=None):
+    """Yields per-file diffs one at a time.
+    Each dict contains the iter_diff_summary fields plus patch and
+    summarized. Binary files and files over max_file_bytes have patch None
+    and summarized set to 'binary' or 'too_large'. Once the patches yielded
+    so far reach max_total_bytes the file that did not fit is yielded with
+    summarized 'budget' and iteration stops.
+    """
+    max_file_bytes = max_file_bytes or config.DIFF_MAX_FILE_BYTES
+    max_total_bytes = max_total_bytes or config.DIFF_MAX_TOTAL_BYTES
+    try:
+        diff_range = _resolve_diff_range(repo_path, source_branch, target_branch)
+        if not diff_range:
+            return
+        base_sha, source_sha = diff_range
+        # Same range as the patches below, even if a branch moves meanwhile
+        files = list(_iter_summary_for_pair(repo_path, base_sha, source_sha))
+        if not files:
+            return
+
+        total = 0
+        # git emits patches in the same order as the raw/numstat summary
+        with _git_stream(mirrors.read_path(repo_path), 'diff', '-M', '--no-color', base_sha, source_sha) as stream:
+            for entry, (header, hunks) in zip(files, _iter_patch_chunks(stream, max_file_bytes)):
+                patch_text, summarized = _build_patch(header, hunks, max_file_bytes)
+                if patch_text is not None:
+                    total += sum(len(line) for line in hunks or header)
+                    if total > max_total_bytes:
+                        yield dict(entry, patch=None, summarized='budget')
+                        return
+                yield dict(entry, patch=patch_text, summarized=summarized)
+    except Exception as e:
+        metrics.observe_error('git', 'iter_diff')
+        print(f"Error generating diff: {e}")
+
 def get_diff(repo_path, source_branch, target_branch='main'):
     """Returns structured per-file diff data as a list of dicts.
-    Each dict contains: path, patch, change_type, additions, deletions.
-    Returns empty list if no changes or error.
+    Each dict contains: path, old_path, patch, change_type, additions,
+    deletions, binary, summarized. Returns empty list if no changes or error.
+    Prefer iter_diff, which keeps only one file in memory at a time.
     """
+    return list(iter_diff(repo_path, source_branch, target_branch))
+
+@instrument('git')
+def get_file_patch(repo_path, source_branch, target_branch, path, old_path=None, max_file_bytes=None):
+    """Returns {'patch', 'summarized'} for a single file of a diff, or None
+    if the branches are missing or the file is not part of the diff.
+    Binary and oversized files have patch None, like in iter_diff."""
+    max_file_bytes = max_file_bytes or config.DIFF_MAX_FILE_BYTES
     try:
-        repo = Repo(repo_path)
-        
-        if source_branch not in repo.heads or target_branch not in repo.heads:
-            return []
+        diff_range = _resolve_diff_range(repo_path, source_branch, target_branch)
+        if not diff_range:
+            return None
+        base_sha, source_sha = diff_range
 
-        # Get commit objects
-        source_commit = repo.heads[source_branch].commit
-        target_commit = repo.heads[target_branch].commit
-        
-        # Get diff
-        diff_index = target_commit.diff(source_commit, create_patch=True)
-        
-        file_diffs = []
-        for diff in diff_index:
-            patch_text = diff.diff.decode('utf-8') if diff.diff else ""
-            # Count additions and deletions from patch
-            additions = patch_text.count('\n+') if patch_text else 0
-            deletions = patch_text.count('\n-') if patch_text else 0
-            
-            file_diffs.append({
-                'path': diff.a_path or diff.b_path,
-                'patch': patch_text,
-                'change_type': diff.change_type,
-                'additions': additions,
-                'deletions': deletions
-            })
-            
-        return file_diffs
+        paths = [path] if not old_path or old_path == path else [old_path, path]
+        # Entries made before paths were passed literally may hold the
+        # patch of another file, hence the new tag
+        cache_key = (os.path.abspath(repo_path), base_sha, source_sha, 'file-patch-literal') + tuple(paths)
+        cached = diff_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # :(literal) stops git from reading [, * and ? in file names as globs
+        pathspecs = [f":(literal){p}" for p in paths]
+        header, hunks = None, []
+        with _git_stream(mirrors.read_path(repo_path), 'diff', '-M', '--no-color', base_sha, source_sha, '--', *pathspecs) as stream:
+            for header, hunks in _iter_patch_chunks(_iter_capped_lines(stream, max_file_bytes)):
+                break
+        if header is None:
+            return None
+
+        patch_text, summarized = _build_patch(header, hunks, max_file_bytes)
+        result = {'patch': patch_text, 'summarized': summarized}
+        diff_cache.put(cache_key, result)
+        return result
     except Exception as e:
-        print(f"Error generating diff: {e}")
-        return []
+        metrics.observe_error('git', 'get_file_patch')
+        print(f"Error generating patch for {path}: {e}")
+        return None
+
+def _iter_capped_lines(stream, max_bytes):
+    """Yields lines from stream until the hunks read exceed max_bytes, so an
+    oversized patch is detected without reading all of it."""
+    read = None
+    for line in stream:
+        yield line
+        if read is None and line.startswith(b'@@'):
+            read = 0
+        if read is not None:
+            read += len(line)
+            if read > max_bytes:
+                return
+
+_SHA = re.compile(r'^[0-9a-f]{40}$')
+
+def _parse_commit_cursor(cursor):
+    """Returns (target_sha, source_sha, skip) from a get_commit_page cursor,
+    or None if it is malformed. Cursors round-trip through the browser, so
+    nothing in them reaches git unchecked."""
+    if not isinstance(cursor, dict):
+        return None
+    target_sha, source_sha, skip = cursor.get('target_sha'), cursor.get('source_sha'), cursor.get('skip')
+    if not isinstance(target_sha, str) or not _SHA.match(target_sha):
+        return None
+    if not isinstance(source_sha, str) or not _SHA.match(source_sha):
+        return None
+    if type(skip) is not int or skip < 0:
+        return None
+    return target_sha, source_sha, skip
+
+@instrument('git')
+def get_commit_page(repo_path, source_branch, target_branch='main', cursor=None, limit=50):
+    """Returns (commits, next_cursor) for the commits on source_branch that
+    are not on target_branch, newest first. Each dict contains sha, author,
+    date and subject. Only the requested page is read from git.
+
+    The cursor pins the SHA pair of the first page, so later pages stay
+    consistent while the branches move; it is None on the last page.
+    Returns ([], None) if either branch is missing, the cursor is invalid
+    or on error.
+    """
+    try:
+        if cursor:
+            parsed = _parse_commit_cursor(cursor)
+            if parsed is None:
+                return [], None
+            target_sha, source_sha, skip = parsed
+        else:
+            pair = _resolve_diff_pair(repo_path, source_branch, target_branch)
+            if not pair:
+                return [], None
+            (target_sha, source_sha), skip = pair, 0
+
+        commits = []
+        with _git_stream(mirrors.read_path(repo_path), 'log', '-z', '--no-color', '--format=%H%x1f%an%x1f%at%x1f%s',
+                         f'--skip={skip}', f'--max-count={limit + 1}', '--end-of-options',
+                         f'{target_sha}..{source_sha}') as stream:
+            for record in _iter_nul_tokens(stream):
+                sha, author, timestamp, subject = record.split('\x1f', 3)
+                commits.append({
+                    'sha': sha,
+                    'author': author,
+                    'date': datetime.utcfromtimestamp(int(timestamp)),
+                    'subject': subject,
+                })
+    except Exception as e:
+        metrics.observe_error('git', 'get_commit_page')
+        print(f"Error listing commits of {source_branch}: {e}")
+        return [], None
 
+    next_cursor = None
+    if len(commits) > limit:
+        commits = commits[:limit]
+        next_cursor = {'target_sha': target_sha, 'source_sha': source_sha, 'skip': skip + limit}
+    return commits, next_cursor
+
+def get_repo_pool_stats():
+    """Returns size and reuse counters of the Repo handle pool."""
+    return repo_pool.stats()
+
+def get_diff_cache_stats():
+    """Returns hit/miss counters and size of the diff cache."""
+    return diff_cache.stats()
+
+def _merge_tree(repo, target_sha, source_sha):
+    """Computes the merge of two commits without touching the working tree
+    or index. Returns (tree_sha, conflicted_paths)."""
+    status, output, error = repo.git.merge_tree(
+        '--write-tree', '--name-only', '--no-messages', '-z', target_sha, source_sha,
+        with_extended_output=True, with_exceptions=False
+    )
+    # Exit status 1 means the merge has conflicts, anything else is an error
+    if status not in (0, 1):
+        raise RuntimeError(error.strip() or f"git merge-tree exited with status {status}")
+    tokens = output.split('\0')
+    conflicts = sorted(set(token for token in tokens[1:] if token))
+    return tokens[0], conflicts
+
+@instrument('git')
+def check_mergeability(repo_path, source_branch, target_branch='main'):
+    """Works out whether source_branch would merge cleanly into
+    target_branch, without touching the working tree or index. Returns a
+    dict with source_sha, target_sha, state ('clean', 'conflicts',
+    'merged' or 'unknown' on git older than 2.38) and conflicts (paths),
+    or None if either branch is missing or on error.
+
+    The result only depends on the two commits, so it is cached per SHA
+    pair.
+    """
+    try:
+        with repo_pool.acquire(mirrors.read_path(repo_path)) as repo:
+            pair = _resolve_branch_pair(repo, source_branch, target_branch)
+            if not pair:
+                return None
+            target_sha, source_sha = pair
+
+            cache_key = (os.path.abspath(repo_path), target_sha, source_sha, 'mergeability')
+            result = diff_cache.get(cache_key)
+            if result is None:
+                result = _mergeability_for_pair(repo, target_sha, source_sha)
+                diff_cache.put(cache_key, result)
+    except Exception as e:
+        metrics.observe_error('git', 'check_mergeability')
+        print(f"Error checking mergeability of {source_branch} into {target_branch} in {repo_path}: {e}")
+        return None
+    return dict(result, source_sha=source_sha, target_sha=target_sha)
+
+def _mergeability_for_pair(repo, target_sha, source_sha):
+    if repo.is_ancestor(source_sha, target_sha):
+        return {'state': 'merged', 'conflicts': []}
+    if repo.is_ancestor(target_sha, source_sha):
+        # Fast-forward
+        return {'state': 'clean', 'conflicts': []}
+    if repo.git.version_info < (2, 38):
+        return {'state': 'unknown', 'conflicts': []}
+    _, conflicts = _merge_tree(repo, target_sha, source_sha)
+    return {'state': 'conflicts' if conflicts else 'clean', 'conflicts': conflicts}
+
+@instrument('git')
 def merge_branch(repo_path, source_branch, target_branch='main'):
+    """Merges source_branch into target_branch.
+
+    By default the merge is computed with `git merge-tree` and recorded by
+    moving the target ref, so the shared working copy is never checked out
+    and merge time depends on the changed paths rather than the repo size.
+    Set GITWATCH_MERGE_MODE=worktree (or run git older than 2.38) to use
+    checkout + merge instead.
+
+    Merges are the one git operation that runs against the working copy;
+    the mirror is fetched as soon as the merge is done. The merge queue
+    only orders merges within one process, so merges into the same repo
+    also take a lock file shared by every process on the host.
+    """
+    with _merge_lock(repo_path):
+        success, message = _merge_in_working_copy(repo_path, source_branch, target_branch)
+    if success:
+        mirrors.fetch_now(repo_path)
+    return success, message
+
+@contextmanager
+def _merge_lock(repo_path):
+    """Blocks until no other process is merging into repo_path."""
+    os.makedirs(config.MERGE_LOCK_DIR, exist_ok=True)
+    repo_path = os.path.abspath(repo_path)
+    digest = hashlib.sha1(repo_path.encode('utf-8')).hexdigest()[:16]
+    with open(os.path.join(config.MERGE_LOCK_DIR, f"merge-{digest}.lock"), 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield  # closing the file releases the lock
+
+def _merge_in_working_copy(repo_path, source_branch, target_branch):
     try:
-        repo = Repo(repo_path)
-        
-        # Checkout target
-        repo.git.checkout(target_branch)
-        
-        # Merge source
-        repo.git.merge(source_branch)
-        
-        return True, "Merge successful"
+        with repo_pool.acquire(repo_path) as repo:
+            if config.MERGE_MODE == 'worktree' or repo.git.version_info < (2, 38):
+                return _merge_branch_worktree(repo, source_branch, target_branch)
+
+            pair = _resolve_branch_pair(repo, source_branch, target_branch)
+            if not pair:
+                return False, "Merge failed: source or target branch does not exist"
+            target_sha, source_sha = pair
+
+            if repo.is_ancestor(source_sha, target_sha):
+                return True, "Already up to date"
+
+            if repo.is_ancestor(target_sha, source_sha):
+                # Fast-forward, like a plain `git merge`
+                new_sha = source_sha
+            else:
+                tree_sha, conflicts = _merge_tree(repo, target_sha, source_sha)
+                if conflicts:
+                    return False, f"Merge failed: conflicts in {', '.join(conflicts)}"
+                new_sha = repo.git.commit_tree(
+                    tree_sha, '-p', target_sha, '-p', source_sha,
+                    '-m', f"Merge branch '{source_branch}' into {target_branch}"
+                )
+
+            # If the target branch is checked out, bring the index and working
+            # tree along first. Two-tree read-tree only touches the changed
+            # paths and refuses if any of them has local changes, in which
+            # case the branch is left where it was.
+            checked_out = not repo.bare and not repo.head.is_detached and repo.active_branch.name == target_branch
+            if checked_out:
+                repo.git.update_index('-q', '--refresh')
+                try:
+                    repo.git.read_tree('-m', '-u', target_sha, new_sha)
+                except Exception as e:
+                    print(f"Not merging {source_branch} into {target_branch}: working tree of {repo_path} has local changes: {e}")
+                    return False, f"Merge failed: {target_branch} is checked out with local changes to the merged files"
+
+            # Compare-and-swap: refuses to move the ref if the target branch
+            # changed since it was resolved above.
+            try:
+                repo.git.update_ref(
+                    '-m', f"gitwatch: merge {source_branch} into {target_branch}",
+                    f"refs/heads/{target_branch}", new_sha, target_sha
+                )
+            except Exception:
+                if checked_out:
+                    repo.git.read_tree('-m', '-u', new_sha, target_sha)
+                raise
+
+            return True, "Merge successful"
     except Exception as e:
+        metrics.observe_error('git', 'merge_branch')
         return False, f"Merge failed: {e}"
+
+def _merge_branch_worktree(repo, source_branch, target_branch):
+    # Checkout target
+    repo.git.checkout(target_branch)
+    
+    # Merge source
+    repo.git.merge(source_branch)
+    
+    return True, "Merge successful"
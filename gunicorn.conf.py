@@ -0,0 +1,31 @@
+"""gunicorn settings for production:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+The app is imported once in the master (preload_app), which runs the
+bootstrap in wsgi.py a single time before the workers are forked.
+"""
+import os
+
+import config
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8050)}"
+workers = config.WEB_WORKERS
+threads = config.WEB_THREADS
+worker_class = 'gthread'
+timeout = config.WEB_TIMEOUT
+preload_app = True
+accesslog = '-'
+
+
+def on_starting(server):
+    if workers > 1 and config.SESSION_BACKEND == 'memory':
+        print("Warning: GITWATCH_SESSION_BACKEND=memory with several workers - "
+              "users will be logged out when requests hit another worker. Use 'sqlite' or 'database'.")
+
+
+def post_fork(server, worker):
+    # Every worker starts the scheduler thread; the lock file in DATA_DIR
+    # lets only one of them run the jobs, and another takes over if it dies
+    from scheduler import scheduler
+    scheduler.start()
@@ -0,0 +1,134 @@
+import os
+import uuid
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from metrics import metrics
+
+
+class MergeQueue:
+    """Runs merge jobs on a bounded thread pool.
+
+    Every repository gets its own lane: jobs for the same repo run one after
+    another, in submission order, so they never race on the working tree.
+    Jobs for different repos run in parallel up to max_workers. A lane only
+    occupies a worker while it has queued jobs.
+    """
+
+    # Finished jobs are kept this long so pollers can pick up the result
+    JOB_RETENTION_SECONDS = 3600
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gitwatch-merge')
+        self._lock = threading.Lock()
+        self._lanes = {}  # repo_path -> deque of job ids waiting to run
+        self._jobs = {}  # job_id -> job dict
+        self._active_keys = {}  # dedupe key -> job_id while queued or running
+
+    def reset_after_fork(self):
+        # Worker threads don't survive a fork; start over with an empty queue
+        self.__init__(self.max_workers)
+
+    def submit(self, repo_path, func, args=(), key=None, on_done=None):
+        """Queues func(*args) on the lane for repo_path and returns the job id.
+
+        func must return a (success, message) tuple. on_done(success, message)
+        is called on the worker once func returns. If key is given and a job
+        with the same key is still queued or running, that job's id is
+        returned instead of queueing a duplicate.
+        """
+        with self._lock:
+            self._prune()
+            if key is not None and key in self._active_keys:
+                return self._active_keys[key]
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'repo_path': repo_path,
+                'status': 'queued',
+                'message': '',
+                'submitted_at': time.time(),
+                'finished_at': None,
+                '_func': func,
+                '_args': args,
+                '_key': key,
+                '_on_done': on_done,
+            }
+            if key is not None:
+                self._active_keys[key] = job_id
+
+            lane = self._lanes.get(repo_path)
+            if lane is None:
+                # No runner for this repo yet - start one
+                self._lanes[repo_path] = deque([job_id])
+                self._executor.submit(self._run_lane, repo_path)
+            else:
+                lane.append(job_id)
+        return job_id
+
+    def _run_lane(self, repo_path):
+        while True:
+            with self._lock:
+                lane = self._lanes[repo_path]
+                if not lane:
+                    del self._lanes[repo_path]
+                    return
+                job = self._jobs[lane.popleft()]
+                job['status'] = 'running'
+            self._run_job(job)
+
+    def _run_job(self, job):
+        try:
+            success, message = job['_func'](*job['_args'])
+        except Exception as e:
+            success, message = False, str(e)
+
+        # The job's status is the merge result: a failing callback must not
+        # report a merge that already happened as failed
+        if job['_on_done']:
+            try:
+                job['_on_done'](success, message)
+            except Exception as e:
+                metrics.observe_error('merge_queue', 'on_done')
+                print(f"Error after merge job {job['id']} ({message}): {e}")
+
+        with self._lock:
+            job['status'] = 'succeeded' if success else 'failed'
+            job['message'] = message
+            job['finished_at'] = time.time()
+            if job['_key'] is not None:
+                self._active_keys.pop(job['_key'], None)
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.JOB_RETENTION_SECONDS
+        expired = [job_id for job_id, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get_job(self, job_id):
+        """Returns a copy of the public job fields, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: v for k, v in job.items() if not k.startswith('_')}
+
+    def stats(self):
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+            return {
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running'),
+                'active_lanes': len(self._lanes),
+            }
+
+
+merge_queue = MergeQueue(config.MERGE_WORKERS)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=merge_queue.reset_after_fork)
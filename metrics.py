@@ -0,0 +1,190 @@
+import time
+import inspect
+import functools
+import threading
+
+import config
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds of the payload size histogram buckets, in bytes
+PAYLOAD_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Arguments worth naming in the slow-call log, if the function takes them
+CONTEXT_ARGS = ('repo_path', 'source_branch', 'target_branch', 'source', 'target', 'branch_name', 'pr_id', 'pathname')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+class Metrics:
+    """In-process call latency, error and payload size metrics.
+
+    Everything is kept in this process; with several server workers each
+    one reports its own numbers. render() returns the Prometheus text
+    exposition format.
+    """
+
+    def __init__(self, slow_seconds):
+        self.slow_seconds = slow_seconds
+        self._lock = threading.Lock()
+        self._latency = {}  # (kind, name) -> Histogram
+        self._errors = {}  # (kind, name) -> count
+        self._payloads = {}  # (callback, direction) -> Histogram
+        self._gauges = []  # (prefix, func returning a dict of numbers)
+
+    def observe_call(self, kind, name, seconds, error=False):
+        with self._lock:
+            histogram = self._latency.get((kind, name))
+            if histogram is None:
+                histogram = self._latency[(kind, name)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            if error:
+                self._errors[(kind, name)] = self._errors.get((kind, name), 0) + 1
+
+    def observe_error(self, kind, name):
+        """Counts a failure that was caught and handled inside the call,
+        which the instrument decorator cannot see."""
+        with self._lock:
+            self._errors[(kind, name)] = self._errors.get((kind, name), 0) + 1
+
+    def observe_payload(self, callback, direction, size):
+        with self._lock:
+            histogram = self._payloads.get((callback, direction))
+            if histogram is None:
+                histogram = self._payloads[(callback, direction)] = Histogram(PAYLOAD_BUCKETS)
+            histogram.observe(size)
+
+    def register_gauges(self, prefix, func):
+        """func() returns a dict of numbers, exported as <prefix>_<key> gauges."""
+        self._gauges.append((prefix, func))
+
+    def log_slow_call(self, kind, name, seconds, func, args, kwargs):
+        try:
+            bound = inspect.signature(func).bind_partial(*args, **kwargs).arguments
+        except TypeError:
+            bound = {}
+        context = ' '.join(f"{arg}={bound[arg]}" for arg in CONTEXT_ARGS if bound.get(arg) is not None)
+        print(f"Slow {kind} {name}: {seconds:.3f}s {context}".rstrip())
+
+    def render(self):
+        lines = []
+        with self._lock:
+            latency = sorted(self._latency.items())
+            errors = sorted(self._errors.items())
+            payloads = sorted(self._payloads.items())
+
+            lines.append("# HELP gitwatch_call_duration_seconds Time spent in callbacks, git and database operations.")
+            lines.append("# TYPE gitwatch_call_duration_seconds histogram")
+            for (kind, name), histogram in latency:
+                self._render_histogram(lines, 'gitwatch_call_duration_seconds', histogram, kind=kind, name=name)
+
+            lines.append("# HELP gitwatch_call_errors_total Calls that raised an exception or handled a failure.")
+            lines.append("# TYPE gitwatch_call_errors_total counter")
+            for (kind, name), count in errors:
+                lines.append(f"gitwatch_call_errors_total{{{_labels(kind=kind, name=name)}}} {count}")
+
+            lines.append("# HELP gitwatch_callback_payload_bytes Size of Dash callback requests and responses.")
+            lines.append("# TYPE gitwatch_callback_payload_bytes histogram")
+            for (callback, direction), histogram in payloads:
+                self._render_histogram(lines, 'gitwatch_callback_payload_bytes', histogram,
+                                       callback=callback, direction=direction)
+
+        for prefix, func in self._gauges:
+            try:
+                values = func()
+            except Exception as e:
+                print(f"Error collecting {prefix} metrics: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {float(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, lines, metric, histogram, **labels):
+        label_str = _labels(**labels)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{label_str},le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{label_str}}} {histogram.sum}")
+        lines.append(f"{metric}_count{{{label_str}}} {histogram.count}")
+
+
+metrics = Metrics(config.METRICS_SLOW_SECONDS)
+
+
+def instrument(kind, name=None, ignore=()):
+    """Decorator that records the latency and errors of every call as
+    kind/name (name defaults to the function name). Exceptions listed in
+    ignore are not counted as errors. Generator functions are timed until
+    the caller stops iterating.
+    """
+    def decorate(func):
+        if not config.METRICS_ENABLED:
+            return func
+        call_name = name or func.__name__
+
+        def finish(started, error, args, kwargs):
+            elapsed = time.perf_counter() - started
+            metrics.observe_call(kind, call_name, elapsed, error)
+            if metrics.slow_seconds and elapsed >= metrics.slow_seconds:
+                metrics.log_slow_call(kind, call_name, elapsed, func, args, kwargs)
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                error = False
+                try:
+                    yield from func(*args, **kwargs)
+                except GeneratorExit:
+                    raise
+                except ignore:
+                    raise
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    finish(started, error, args, kwargs)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = False
+            try:
+                return func(*args, **kwargs)
+            except ignore:
+                raise
+            except BaseException:
+                error = True
+                raise
+            finally:
+                finish(started, error, args, kwargs)
+        return wrapper
+    return decorate
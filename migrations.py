@@ -0,0 +1,311 @@
+"""Versioned schema migrations.
+
+Each migration has an integer version and runs once per database; applied
+versions are recorded in the schema_version table. Migrations only use
+SQLAlchemy constructs, so they run on SQLite and PostgreSQL alike.
+
+Migrations must never change once released - add a new one instead. Every
+migration must also tolerate objects that already exist, because databases
+created before this module existed already have the baseline tables.
+
+    python migrations.py upgrade   # apply pending migrations to config.DB_PATH
+    python migrations.py current   # print the current schema version
+    python migrations.py check     # migrate a scratch SQLite database and
+                                   # compare it with the models in db.py
+"""
+import sys
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey,
+    Index, inspect, text
+)
+
+MIGRATIONS = []
+
+# Arbitrary key for pg_advisory_xact_lock so replicas migrate one at a time
+_PG_LOCK_KEY = 7143160153
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+# --- Helpers ---
+
+def create_table(conn, table):
+    table.create(conn, checkfirst=True)
+
+
+def create_index(conn, name, table_name, *columns, unique=False):
+    table = Table(table_name, MetaData(), autoload_with=conn)
+    Index(name, *[table.c[col] for col in columns], unique=unique).create(conn, checkfirst=True)
+
+
+def add_column(conn, table_name, column):
+    if column.name in {c['name'] for c in inspect(conn).get_columns(table_name)}:
+        return
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"))
+
+
+# --- Migrations ---
+
+@migration(1, "Baseline schema: users, repositories, pull_requests, comments")
+def _baseline(conn):
+    metadata = MetaData()
+    tables = [
+        Table(
+            'users', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('username', String, unique=True, nullable=False),
+            Column('password_hash', String, nullable=False),
+            Column('is_admin', Boolean),
+        ),
+        Table(
+            'repositories', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('name', String, unique=True, nullable=False),
+            Column('path', String, nullable=False),
+            Column('remote_path', String, nullable=True),
+        ),
+        Table(
+            'pull_requests', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('title', String, nullable=False),
+            Column('description', Text),
+            Column('author_id', Integer, ForeignKey('users.id')),
+            Column('repo_id', Integer, ForeignKey('repositories.id')),
+            Column('source_branch', String, nullable=False),
+            Column('target_branch', String),
+            Column('status', String),
+            Column('created_at', DateTime),
+        ),
+        Table(
+            'comments', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('pr_id', Integer, ForeignKey('pull_requests.id')),
+            Column('user_id', Integer, ForeignKey('users.id')),
+            Column('content', Text, nullable=False),
+            Column('created_at', DateTime),
+        ),
+    ]
+    for table in tables:
+        create_table(conn, table)
+
+
+@migration(2, "Indexes for dashboard pagination and repository lookups")
+def _dashboard_indexes(conn):
+    create_index(conn, 'ix_pull_requests_repo_id', 'pull_requests', 'repo_id')
+    create_index(conn, 'ix_pull_requests_created_at', 'pull_requests', 'created_at')
+    create_index(conn, 'ix_pull_requests_status_created_at', 'pull_requests', 'status', 'created_at', 'id')
+    create_index(conn, 'ix_repositories_path', 'repositories', 'path')
+
+
+@migration(3, "Index for paginated comment threads")
+def _comment_index(conn):
+    create_index(conn, 'ix_comments_pr_id_created_at', 'comments', 'pr_id', 'created_at', 'id')
+
+
+@migration(4, "Change feed events for live updates")
+def _events(conn):
+    metadata = MetaData()
+    Table('pull_requests', metadata, autoload_with=conn)
+    Table('comments', metadata, autoload_with=conn)
+    create_table(conn, Table(
+        'events', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('kind', String, nullable=False),
+        Column('pr_id', Integer, ForeignKey('pull_requests.id'), nullable=False),
+        Column('comment_id', Integer, ForeignKey('comments.id'), nullable=True),
+        Column('status', String, nullable=True),
+        Column('created_at', DateTime),
+    ))
+    create_index(conn, 'ix_events_pr_id_id', 'events', 'pr_id', 'id')
+
+
+@migration(5, "Precomputed diff stats per pull request")
+def _pr_stats(conn):
+    metadata = MetaData()
+    Table('pull_requests', metadata, autoload_with=conn)
+    create_table(conn, Table(
+        'pr_stats', metadata,
+        Column('pr_id', Integer, ForeignKey('pull_requests.id'), primary_key=True),
+        Column('source_sha', String, nullable=False),
+        Column('target_sha', String, nullable=False),
+        Column('files_changed', Integer, nullable=False),
+        Column('additions', Integer, nullable=False),
+        Column('deletions', Integer, nullable=False),
+        Column('computed_at', DateTime),
+    ))
+
+
+@migration(6, "Full-text search index over pull requests and comments (SQLite FTS5)")
+def _search_index(conn):
+    # Other databases search with LIKE (see db.search_prs)
+    if conn.dialect.name != 'sqlite':
+        return
+    if not conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+        print("SQLite was built without FTS5; search will fall back to LIKE")
+        return
+
+    # External-content tables: the text stays in pull_requests/comments and
+    # the triggers keep the index in step with every write
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS pr_search USING fts5("
+        "title, description, content='pull_requests', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS comment_search USING fts5("
+        "content, content='comments', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+
+        "CREATE TRIGGER IF NOT EXISTS pull_requests_search_ai AFTER INSERT ON pull_requests BEGIN "
+        "INSERT INTO pr_search(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS pull_requests_search_ad AFTER DELETE ON pull_requests BEGIN "
+        "INSERT INTO pr_search(pr_search, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS pull_requests_search_au AFTER UPDATE OF title, description ON pull_requests BEGIN "
+        "INSERT INTO pr_search(pr_search, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO pr_search(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+
+        "CREATE TRIGGER IF NOT EXISTS comments_search_ai AFTER INSERT ON comments BEGIN "
+        "INSERT INTO comment_search(rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS comments_search_ad AFTER DELETE ON comments BEGIN "
+        "INSERT INTO comment_search(comment_search, rowid, content) VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS comments_search_au AFTER UPDATE OF content ON comments BEGIN "
+        "INSERT INTO comment_search(comment_search, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO comment_search(rowid, content) VALUES (new.id, new.content); END",
+
+        # Index everything written before the triggers existed
+        "INSERT INTO pr_search(pr_search) VALUES ('rebuild')",
+        "INSERT INTO comment_search(comment_search) VALUES ('rebuild')",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+@migration(7, "Background mergeability results per pull request")
+def _pr_mergeability(conn):
+    metadata = MetaData()
+    Table('pull_requests', metadata, autoload_with=conn)
+    create_table(conn, Table(
+        'pr_mergeability', metadata,
+        Column('pr_id', Integer, ForeignKey('pull_requests.id'), primary_key=True),
+        Column('source_sha', String, nullable=False),
+        Column('target_sha', String, nullable=False),
+        Column('state', String, nullable=False),
+        Column('conflicts', Text),
+        Column('checked_at', DateTime),
+    ))
+
+
+@migration(8, "Server-side sessions for GITWATCH_SESSION_BACKEND=database")
+def _sessions(conn):
+    metadata = MetaData()
+    create_table(conn, Table(
+        'sessions', metadata,
+        Column('token', String, primary_key=True),
+        Column('data', Text, nullable=False),
+        Column('expires_at', Float, nullable=False),
+    ))
+    create_index(conn, 'ix_sessions_expires_at', 'sessions', 'expires_at')
+
+
+# --- Runner ---
+
+_version_metadata = MetaData()
+schema_version = Table(
+    'schema_version', _version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def current_version(engine):
+    with engine.connect() as conn:
+        if not inspect(conn).has_table('schema_version'):
+            return 0
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def upgrade(engine, target=None):
+    """Applies all pending migrations (up to target) and returns the list of
+    versions that were applied. Each migration runs in its own transaction."""
+    applied = []
+    with engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+
+    for version, description, func in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': _PG_LOCK_KEY})
+            done = conn.execute(
+                text("SELECT 1 FROM schema_version WHERE version = :version"), {'version': version}
+            ).first()
+            if done:
+                continue
+            func(conn)
+            conn.execute(schema_version.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        applied.append(version)
+    return applied
+
+
+def check(url=None):
+    """Migrates a scratch database (a temporary SQLite file by default) and
+    returns a list of differences between it and the models in db.py."""
+    from sqlalchemy import create_engine
+    import db
+
+    if url is None:
+        url = f"sqlite:///{tempfile.mkdtemp(prefix='gitwatch-migrations-')}/check.db"
+    engine = create_engine(url)
+    upgrade(engine)
+
+    problems = []
+    inspector = inspect(engine)
+    for table in db.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            problems.append(f"missing table {table.name}")
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                problems.append(f"missing column {table.name}.{column.name}")
+        indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                problems.append(f"missing index {index.name} on {table.name}")
+    engine.dispose()
+    return problems
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'upgrade'
+    if command == 'check':
+        problems = check(argv[2] if len(argv) > 2 else None)
+        for problem in problems:
+            print(problem)
+        print("Migrations match the models" if not problems else f"{len(problems)} problem(s) found")
+        return 1 if problems else 0
+
+    import db
+    if command == 'current':
+        print(current_version(db.engine))
+    elif command == 'upgrade':
+        applied = upgrade(db.engine)
+        print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
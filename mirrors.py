@@ -0,0 +1,196 @@
+import os
+import time
+import random
+import hashlib
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from metrics import metrics, instrument
+
+
+class Mirrors:
+    """Bare mirrors of the working copies, used for every git read.
+
+    Branch lists, diffs and merge checks read from the mirror, so they
+    never contend with a merge updating the working copy and git never has
+    to look at a working tree. Only merges and branch creation write to
+    the working copy; they fetch into the mirror right after.
+
+    Mirrors are kept fresh by fetch_due(), run periodically by the
+    scheduler. Each repo has its own fetch interval: it starts at
+    min_interval, doubles (up to max_interval) every time a fetch brings
+    nothing new and drops back once one does, so idle repos cost little.
+    Until a repo's mirror has been created, reads use the working copy.
+    """
+
+    # How often the scheduler looks for repos that are due
+    TICK_SECONDS = 5
+
+    def __init__(self, mirrors_path, min_interval, max_interval, concurrency, jitter=0.1):
+        self.mirrors_path = mirrors_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self._paths = {}  # abs working copy path -> mirror path
+        self._ready = set()  # mirror paths known to exist
+        self._schedule = {}  # abs working copy path -> {'interval', 'next_fetch'}
+        self._fetch_locks = {}  # mirror path -> Lock
+        self._lock = threading.Lock()
+        self.fetches = 0
+        self.failures = 0
+        self.updated = 0
+
+    def reset_after_fork(self):
+        self._fetch_locks = {}
+        self._lock = threading.Lock()
+
+    def default_path(self, repo_path):
+        """Where the mirror of repo_path goes unless Repository.remote_path
+        says otherwise."""
+        repo_path = os.path.abspath(repo_path)
+        digest = hashlib.sha1(repo_path.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.mirrors_path, f"{os.path.basename(repo_path)}-{digest}.git")
+
+    def register(self, repo_path, remote_path):
+        with self._lock:
+            self._paths[os.path.abspath(repo_path)] = remote_path or self.default_path(repo_path)
+
+    def mirror_path(self, repo_path):
+        with self._lock:
+            path = self._paths.get(os.path.abspath(repo_path))
+        return path or self.default_path(repo_path)
+
+    def read_path(self, repo_path):
+        """Returns the path git reads for repo_path should use: the mirror
+        once it exists, the working copy until then."""
+        if not config.MIRRORS_ENABLED:
+            return repo_path
+        mirror = self.mirror_path(repo_path)
+        if mirror in self._ready:
+            return mirror
+        if os.path.isdir(mirror):
+            with self._lock:
+                self._ready.add(mirror)
+            return mirror
+        return repo_path
+
+    def _fetch_lock(self, mirror):
+        with self._lock:
+            return self._fetch_locks.setdefault(mirror, threading.Lock())
+
+    @instrument('git', name='mirror_fetch')
+    def fetch(self, repo_path):
+        """Creates or updates the mirror of repo_path. Returns True if any
+        branch moved, False if nothing changed or on error."""
+        if not config.MIRRORS_ENABLED:
+            return False
+        mirror = self.mirror_path(repo_path)
+        with self._fetch_lock(mirror):
+            try:
+                if not os.path.isdir(mirror):
+                    self._clone(repo_path, mirror)
+                    changed = True
+                else:
+                    before = self._heads(mirror)
+                    _git(mirror, 'fetch', '--prune', '--quiet', 'origin')
+                    changed = self._heads(mirror) != before
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                metrics.observe_error('git', 'mirror_fetch')
+                print(f"Error fetching {repo_path} into {mirror}: {e}")
+                return False
+        with self._lock:
+            self.fetches += 1
+            self.updated += int(changed)
+            self._ready.add(mirror)
+        return changed
+
+    def _clone(self, repo_path, mirror):
+        # Clone next to the final path and rename, so readers never see a
+        # half-written mirror. Local clones hardlink the object files.
+        os.makedirs(os.path.dirname(mirror), exist_ok=True)
+        partial = f"{mirror}.partial-{os.getpid()}"
+        shutil.rmtree(partial, ignore_errors=True)
+        try:
+            _git(None, 'clone', '--mirror', '--quiet', os.path.abspath(repo_path), partial)
+            os.rename(partial, mirror)
+        finally:
+            shutil.rmtree(partial, ignore_errors=True)
+
+    def _heads(self, mirror):
+        return _git(mirror, 'for-each-ref', '--format=%(objectname) %(refname)', 'refs/heads')
+
+    def fetch_due(self, repos):
+        """Fetches every repo in repos (working copy path, remote_path
+        pairs) whose interval has passed, at most `concurrency` at a time."""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for repo_path, remote_path in repos:
+                key = os.path.abspath(repo_path)
+                self._paths[key] = remote_path or self.default_path(repo_path)
+                entry = self._schedule.setdefault(key, {'interval': self.min_interval, 'next_fetch': 0.0})
+                if entry['next_fetch'] <= now:
+                    due.append(key)
+        if not due:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='gitwatch-fetch') as executor:
+            results = list(executor.map(self.fetch, due))
+
+        now = time.monotonic()
+        with self._lock:
+            for key, changed in zip(due, results):
+                entry = self._schedule[key]
+                entry['interval'] = self.min_interval if changed else min(entry['interval'] * 2, self.max_interval)
+                self._reschedule(entry, now)
+
+    def fetch_now(self, repo_path):
+        """Fetches repo_path right away, e.g. after writing to the working
+        copy, and puts it back on the shortest interval."""
+        if not config.MIRRORS_ENABLED or not os.path.isdir(self.mirror_path(repo_path)):
+            return
+        self.fetch(repo_path)
+        with self._lock:
+            entry = self._schedule.get(os.path.abspath(repo_path))
+            if entry is not None:
+                entry['interval'] = self.min_interval
+                self._reschedule(entry, time.monotonic())
+
+    def _reschedule(self, entry, now):
+        # Caller holds the lock
+        spread = entry['interval'] * self.jitter
+        entry['next_fetch'] = now + entry['interval'] + random.uniform(-spread, spread)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'repos': len(self._schedule),
+                'ready': len(self._ready),
+                'fetches': self.fetches,
+                'updated': self.updated,
+                'failures': self.failures,
+            }
+
+
+def _git(cwd, *args):
+    cmd = ['git', *args] if cwd is None else ['git', '-C', cwd, *args]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=config.MIRROR_FETCH_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"git {args[0]} exited with {result.returncode}")
+    return result.stdout
+
+
+mirrors = Mirrors(
+    config.MIRRORS_PATH,
+    config.MIRROR_FETCH_INTERVAL,
+    config.MIRROR_FETCH_MAX_INTERVAL,
+    config.MIRROR_FETCH_CONCURRENCY,
+)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=mirrors.reset_after_fork)
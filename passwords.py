@@ -0,0 +1,129 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+import config
+
+
+class PasswordQueueFull(Exception):
+    """Raised when too many password hashes are already queued or running."""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small process pool instead of the request thread.
+
+    At most max_pending hashes may be queued or running at once; beyond
+    that PasswordQueueFull is raised straight away so callers can tell the
+    user to retry instead of piling up behind a burst of logins. With
+    workers=0 hashing runs inline on the calling thread.
+    """
+
+    def __init__(self, workers, max_pending, rounds, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn, not fork: the server process is multi-threaded
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _inline(self):
+        # Pool workers (and anything they import) must not start pools of their own
+        return self.workers <= 0 or multiprocessing.parent_process() is not None
+
+    def _run(self, func, *args):
+        if self._inline():
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise PasswordQueueFull("Too many password operations in progress")
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordQueueFull("Timed out waiting for a password worker")
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next request
+            with self._executor_lock:
+                self._executor = None
+            raise
+
+    def hash_password(self, password):
+        return self._run(_hashpw, password, self.rounds)
+
+    def verify_password(self, password, password_hash):
+        return self._run(_checkpw, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different cost than configured."""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def reset_after_fork(self):
+        # A forked child can't use the parent's pool or semaphore state
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=config.PASSWORD_WORKERS,
+    max_pending=config.PASSWORD_MAX_PENDING,
+    rounds=config.BCRYPT_ROUNDS,
+    timeout=config.PASSWORD_TIMEOUT,
+)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=password_hasher.reset_after_fork)
+
+
+def hash_password(password):
+    return password_hasher.hash_password(password)
+
+
+def hash_password_inline(password):
+    """Hashes on the calling thread. For one-off startup work that runs
+    before the server takes requests."""
+    return _hashpw(password, password_hasher.rounds)
+
+
+def verify_password(password, password_hash):
+    return password_hasher.verify_password(password, password_hash)
+
+
+def needs_rehash(password_hash):
+    return password_hasher.needs_rehash(password_hash)
@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import config
+
+
+class RepoPool:
+    """Thread-safe pool of GitPython Repo handles keyed by repository path.
+
+    A Repo is not safe to share between threads (its persistent
+    `git cat-file` processes are stateful), so handles are checked out for
+    exclusive use and returned afterwards. Up to max_idle handles are kept
+    around for reuse; handles idle for longer than idle_timeout seconds are
+    closed, which also stops their cat-file subprocesses.
+    """
+
+    def __init__(self, max_idle, idle_timeout):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # path -> list of (repo, returned_at), most recent last
+        self._idle_count = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    @contextmanager
+    def acquire(self, repo_path):
+        """Yields a Repo for repo_path that is exclusive to the caller."""
+        key = os.path.abspath(repo_path)
+        repo = self._checkout(key)
+        try:
+            yield repo
+        except BaseException:
+            # The handle may be mid-command; don't hand it to anyone else
+            with self._lock:
+                self._in_use -= 1
+            repo.close()
+            raise
+        else:
+            self._checkin(key, repo)
+
+    def _checkout(self, key):
+        with self._lock:
+            expired = self._pop_expired(time.monotonic())
+            handles = self._idle.get(key)
+            repo = None
+            if handles:
+                repo, _ = handles.pop()
+                if not handles:
+                    del self._idle[key]
+                self._idle_count -= 1
+                self.reused += 1
+                self._in_use += 1
+        self._close_all(expired)
+        if repo is not None:
+            return repo
+
+        # GitPython takes a while to import; only pay for it once git is used
+        from git import Repo
+        repo = Repo(key)
+        with self._lock:
+            self.created += 1
+            self._in_use += 1
+        return repo
+
+    def _checkin(self, key, repo):
+        now = time.monotonic()
+        with self._lock:
+            self._in_use -= 1
+            self._idle.setdefault(key, []).append((repo, now))
+            self._idle_count += 1
+            expired = self._pop_expired(now)
+            while self._idle_count > self.max_idle:
+                expired.append(self._pop_oldest())
+        self._close_all(expired)
+
+    def _pop_expired(self, now):
+        # Caller holds the lock
+        cutoff = now - self.idle_timeout
+        expired = []
+        for key in list(self._idle):
+            handles = self._idle[key]
+            fresh = [(repo, ts) for repo, ts in handles if ts >= cutoff]
+            expired.extend(repo for repo, ts in handles if ts < cutoff)
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+        self._idle_count -= len(expired)
+        return expired
+
+    def _pop_oldest(self):
+        # Caller holds the lock
+        oldest_key = min(self._idle, key=lambda k: self._idle[k][0][1])
+        handles = self._idle[oldest_key]
+        repo, _ = handles.pop(0)
+        if not handles:
+            del self._idle[oldest_key]
+        self._idle_count -= 1
+        return repo
+
+    def _close_all(self, repos):
+        for repo in repos:
+            repo.close()
+        if repos:
+            with self._lock:
+                self.evicted += len(repos)
+
+    def reset_after_fork(self):
+        # Idle handles share cat-file pipes with the parent; drop them unclosed
+        self._idle = {}
+        self._idle_count = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Closes every idle handle."""
+        with self._lock:
+            repos = [repo for handles in self._idle.values() for repo, _ in handles]
+            self._idle.clear()
+            self._idle_count = 0
+        self._close_all(repos)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._idle_count + self._in_use,
+                'idle': self._idle_count,
+                'in_use': self._in_use,
+                'repos': len(self._idle),
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted,
+            }
+
+
+repo_pool = RepoPool(config.REPO_POOL_MAX_IDLE, config.REPO_POOL_IDLE_SECONDS)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=repo_pool.reset_after_fork)
@@ -0,0 +1,131 @@
+import time
+import random
+import threading
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, every process leads
+    fcntl = None
+
+
+class LeaderLock:
+    """Non-blocking exclusive lock on a file. With several server processes
+    on one host, the one holding it runs the background jobs. The lock is
+    released by the OS when the holder exits, so another process takes
+    over on its next attempt."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        if self._file is not None or fcntl is None:
+            return True
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    @property
+    def held(self):
+        return self._file is not None or fcntl is None
+
+
+class PeriodicTask:
+    def __init__(self, name, interval, func, jitter):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.jitter = jitter
+        self.next_run = 0.0
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = None
+
+    def schedule_next(self, now):
+        spread = self.interval * self.jitter
+        self.next_run = now + self.interval + random.uniform(-spread, spread)
+
+
+class Scheduler:
+    """Runs periodic tasks on a single daemon thread, but only while this
+    process is the leader. Tasks run one at a time; a task that needs
+    parallelism brings its own pool.
+
+    Start it in each server process after forking (gunicorn.conf.py does
+    this in post_fork), never in a preloading parent.
+    """
+
+    # How often a non-leader checks whether the leader went away
+    LEADER_RETRY_SECONDS = 30
+
+    def __init__(self, lock_path):
+        self.lock = LeaderLock(lock_path)
+        self._tasks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def add(self, name, interval, func, jitter=0.1):
+        """Registers func() to run every interval seconds, +/- jitter as a
+        fraction of the interval so hosts don't run in lockstep."""
+        with self._lock:
+            self._tasks.append(PeriodicTask(name, interval, func, jitter))
+
+    def start(self):
+        if not config.SCHEDULER_ENABLED:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='gitwatch-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.lock.acquire():
+                self._stop.wait(self.LEADER_RETRY_SECONDS)
+                continue
+
+            now = time.monotonic()
+            with self._lock:
+                due = [task for task in self._tasks if task.next_run <= now]
+            for task in due:
+                self._run_task(task)
+
+            with self._lock:
+                next_run = min((task.next_run for task in self._tasks), default=now + 1)
+            self._stop.wait(max(0.1, next_run - time.monotonic()))
+
+    def _run_task(self, task):
+        started = time.monotonic()
+        try:
+            task.func()
+        except Exception as e:
+            task.failures += 1
+            print(f"Background task {task.name} failed: {e}")
+        task.runs += 1
+        task.last_duration = time.monotonic() - started
+        task.schedule_next(time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leader': int(self.lock.held),
+                'tasks': len(self._tasks),
+                'runs': sum(task.runs for task in self._tasks),
+                'failures': sum(task.failures for task in self._tasks),
+            }
+
+
+scheduler = Scheduler(config.SCHEDULER_LOCK_PATH)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import secrets
+import sqlite3
+import threading
+
+import config
+
+
+class MemorySessionBackend:
+    """Sessions in a dict. Only valid for a single server process."""
+
+    def __init__(self):
+        self._sessions = {}  # token -> (data, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._sessions.get(token)
+        return entry
+
+    def set(self, token, data, expires_at):
+        with self._lock:
+            self._sessions[token] = (data, expires_at)
+
+    def delete(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def purge(self, now):
+        with self._lock:
+            for token in [t for t, (_, expires_at) in self._sessions.items() if expires_at <= now]:
+                del self._sessions[token]
+
+
+class SqliteSessionBackend:
+    """Sessions in a SQLite file, shared by every process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "token TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)")
+            # Files created by earlier versions have an unused user_id column
+            conn.execute("DROP INDEX IF EXISTS ix_sessions_user_id")
+            if 'user_id' in [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]:
+                try:
+                    conn.execute("ALTER TABLE sessions DROP COLUMN user_id")
+                except sqlite3.OperationalError:
+                    pass  # SQLite before 3.35; the column is nullable and ignored
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=config.DB_BUSY_TIMEOUT_MS / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, token):
+        row = self._connect().execute("SELECT data, expires_at FROM sessions WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, token, data, expires_at):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (token, data, expires_at) VALUES (?, ?, ?)",
+                (token, json.dumps(data), expires_at)
+            )
+
+    def delete(self, token):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def purge(self, now):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+
+class DatabaseSessionBackend:
+    """Sessions in the application database (GITWATCH_DATABASE_URL), shared
+    by every process and replica that uses it, e.g. several hosts on one
+    PostgreSQL server. The sessions table is created by the migrations."""
+
+    def __init__(self, session_factory, model):
+        self.session_factory = session_factory
+        self.model = model
+
+    def get(self, token):
+        with self.session_factory() as session:
+            row = session.get(self.model, token)
+            if row is None:
+                return None
+            return json.loads(row.data), row.expires_at
+
+    def set(self, token, data, expires_at):
+        with self.session_factory() as session:
+            session.merge(self.model(token=token, data=json.dumps(data), expires_at=expires_at))
+            session.commit()
+
+    def delete(self, token):
+        with self.session_factory() as session:
+            session.query(self.model).filter_by(token=token).delete()
+            session.commit()
+
+    def purge(self, now):
+        with self.session_factory() as session:
+            session.query(self.model).filter(self.model.expires_at <= now).delete()
+            session.commit()
+
+
+class SessionStore:
+    """Maps opaque session tokens to server-side session data.
+
+    The browser only ever holds the token. Sessions expire ttl seconds after
+    they were last refreshed; a session that is used after half its ttl has
+    passed is extended. Revoking a token logs that browser out on its next
+    request.
+    """
+
+    # Expired sessions are purged at most this often
+    PURGE_INTERVAL = 300
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self._last_purge = 0.0
+
+    def create(self, data):
+        token = secrets.token_urlsafe(32)
+        self.backend.set(token, data, time.time() + self.ttl)
+        self._maybe_purge()
+        return token
+
+    def get(self, token):
+        """Returns the session data for token, or None if unknown or expired."""
+        if not token or not isinstance(token, str):
+            return None
+        entry = self.backend.get(token)
+        if entry is None:
+            return None
+        data, expires_at = entry
+        now = time.time()
+        if expires_at <= now:
+            self.backend.delete(token)
+            return None
+        if expires_at - now < self.ttl / 2:
+            self.backend.set(token, data, now + self.ttl)
+        return data
+
+    def revoke(self, token):
+        if token and isinstance(token, str):
+            self.backend.delete(token)
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge > self.PURGE_INTERVAL:
+            self._last_purge = now
+            self.backend.purge(now)
+
+
+def _create_backend():
+    if config.SESSION_BACKEND == 'sqlite':
+        return SqliteSessionBackend(config.SESSION_DB_PATH)
+    if config.SESSION_BACKEND == 'database':
+        import db
+        return DatabaseSessionBackend(db.Session, db.UserSession)
+    if config.SESSION_BACKEND != 'memory':
+        print(f"Unknown session backend {config.SESSION_BACKEND!r}, using memory")
+    return MemorySessionBackend()
+
+
+session_store = SessionStore(_create_backend(), config.SESSION_TTL)
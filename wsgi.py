@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers (see gunicorn.conf.py)."""
+from app import app, bootstrap
+
+bootstrap()
+
+# GitPython is imported on first use. Under preload_app that would happen
+# in every worker, so load it once here before they are forked.
+import git
+
+application = app.server